@@ -7,6 +7,7 @@ from flask import Flask
 from rq_scheduler import Scheduler
 
 from config import app_config
+from settings import get_settings
 from extensions import bcrypt, cors, mail, db, migrate
 
 app = Flask(__name__, instance_relative_config=True)
@@ -25,29 +26,37 @@ migrate.init_app(app, db)
 def create_app():
     global app
 
-    def process_str(string):
-        return string and type(string) == str
+    # .flaskenv and .env are only read once per process, see settings.py
+    settings = get_settings()
+    app.config.from_object(".".join(["config", app_config[settings.flask_env]]))
 
-    from dotenv import dotenv_values, load_dotenv
-    flask_config = dotenv_values(".flaskenv")
-    flask_env = flask_config.get('FLASK_ENV')
+    from . import models, utils, routes, views, controllers, commands
 
-    config_name = flask_env if process_str(flask_env) else 'production'
+    # Logging is configured once per process, however many times the app is created
+    utils.configure_logging(app)
 
-    load_dotenv('.env')
-
-    if config_name not in app_config.keys():
-        config_name = 'development'
-    app.config.from_object(".".join(["config", app_config[config_name]]))
-
-    from . import models, utils, routes, views
+    # Register any additional intents, so that new problem types need no code changes
+    if app.config.get('INTENTS_FILE'):
+        controllers.SocketsController.INTENTS.load(app.config['INTENTS_FILE'])
 
     # Initialize Redis
-    redis_url = utils.Helper.generate_redis_url()
-    app.redis = Redis.from_url(redis_url if redis_url and type(redis_url) == str else 'redis://')
-
-    # Queue for tasks to be run ASAP
-    app.task_queue = Queue(f'{app.config["REDIS_ROOT"]}_tasks', connection=app.redis)
+    app.redis = Redis.from_url(settings.redis_url)
+
+    # Pooled client for the upstream APIs and the cache of their responses
+    app.http = utils.HttpClient.from_config(app.config)
+    app.cache = utils.ResponseCache(
+        max_size=app.config['CACHE_SIZE'],
+        redis=app.redis if app.config['CACHE_USE_REDIS'] else None,
+        prefix=f'{app.config["REDIS_ROOT"]}_cache',
+    )
+
+    # Queues for tasks to be run ASAP, one per priority class, drained by workers from the highest priority
+    app.queues = {
+        priority: Queue(f'{app.config["REDIS_ROOT"]}_{suffix}', connection=app.redis)
+        for priority, suffix in utils.priority_queues.items()
+    }
+    # Queue for processing clients' messages, and queue of the tasks without a priority class
+    app.reply_queue, app.task_queue = app.queues['interactive'], app.queues['default']
     # Scheduler for tasks to be run at given periods
     app.scheduler = Scheduler(f'{app.config["REDIS_ROOT"]}_scheduler', connection=app.redis)
 
@@ -78,68 +87,10 @@ def init_db():
             utils.system_logging(ex, exception=True)
             db.session.rollback()
 
-        try:
-            import json
-            import uuid
-
-            with open('database.json') as fp:
-                values = json.load(fp)
-
-                for receipt in values.get('receipt'):
-                    if not models.ReceiptModel.query.filter_by(
-                            created_at=receipt.get('created_at'),
-                            description=receipt.get('description'),
-                            merchant_id=receipt.get('merchant_id'),
-                            status=receipt.get('status'),
-                            value=receipt.get('value'),
-                    ).all():
-                        r = models.ReceiptModel(
-                            id=uuid.uuid4(),
-                            created_at=receipt.get('created_at'),
-                            description=receipt.get('description'),
-                            merchant_id=receipt.get('merchant_id'),
-                            status=receipt.get('status'),
-                            value=receipt.get('value'),
-                        )
-                        r.save()
-
-                for sale in values.get('sales'):
-                    if not models.SaleModel.query.filter_by(
-                            chip_id=sale.get('chip_id'),
-                            created_at=sale.get('created_at'),
-                            description=sale.get('description'),
-                            id_sale=sale.get('id_sale'),
-                            merchant_id=sale.get('merchant_id'),
-                            status=sale.get('status'),
-                    ).all():
-                        s = models.SaleModel(
-                            id=uuid.uuid4(),
-                            chip_id=sale.get('chip_id'),
-                            created_at=sale.get('created_at'),
-                            description=sale.get('description'),
-                            id_sale=sale.get('id_sale'),
-                            merchant_id=sale.get('merchant_id'),
-                            status=sale.get('status'),
-                        )
-                        s.save()
-
-                for transaction in values.get('transaction'):
-                    if not models.TransactionModel.query.filter_by(
-                            created_at=transaction.get('created_at'),
-                            transaction_id=transaction.get('transaction_id'),
-                            merchant_id=transaction.get('merchant_id'),
-                            value=transaction.get('value'),
-                    ).all():
-                        t = models.TransactionModel(
-                            id=uuid.uuid4(),
-                            created_at=transaction.get('created_at'),
-                            transaction_id=transaction.get('transaction_id'),
-                            merchant_id=transaction.get('merchant_id'),
-                            value=transaction.get('value'),
-                        )
-                        t.save()
-        except Exception as err:
-            utils.system_logging(f'Error saving existing financials:\n{err}', exception=True)
+        # The existing financials are loaded outside of request handling, by the `flask seed` command
+
+        # Drop scheduled tasks left behind, or duplicated, by earlier deployments
+        controllers.TasksController.reconcile_scheduled_tasks()
 
         # TODO
         # controllers.TasksController.launch_task(
@@ -0,0 +1,69 @@
+# app/commands.py
+
+"""
+This module defines the custom commands run through the flask CLI
+"""
+
+import time
+
+import click
+
+from app import app
+
+
+@app.cli.command('seed')
+@click.argument('path', default='database.json')
+@click.option('--table', type=click.Choice(['receipt', 'sales', 'transaction']), help='Table of a CSV export')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows inserted per statement')
+def seed(path, table, batch_size):
+    """Load the financials snapshot at PATH (JSON, or CSV with --table). Rows already loaded are skipped"""
+    from .utils import SeedLoader
+
+    if path.lower().endswith('.csv') and not table:
+        raise click.UsageError('--table is required when loading a CSV export')
+
+    start = time.perf_counter()
+    counts = SeedLoader(batch_size=batch_size).load(path, table)
+    for name, count in counts.items():
+        click.echo(f'{name}: {count} rows processed')
+    click.echo(f'Done in {time.perf_counter() - start:.2f}s')
+
+
+@app.cli.command('worker')
+@click.option('--burst', is_flag=True, help='Quit once all queues are empty')
+@click.option(
+    '--priority', 'priorities', multiple=True, type=click.Choice(['interactive', 'default', 'bulk']),
+    help='Only drain the queues of these priority classes. Defaults to all',
+)
+def worker(burst, priorities):
+    """Run an RQ worker for the task queues, with the application set up once for all jobs"""
+    from .utils import AppWorker
+
+    # Queues are drained in strict priority order, so clients' messages go before maintenance jobs
+    queues = [queue for priority, queue in app.queues.items() if not priorities or priority in priorities]
+    AppWorker(queues, connection=app.redis).work(burst=burst)
+
+
+@app.cli.command('queues')
+def queues():
+    """Show the depth and wait times of the queue of every priority class"""
+    from .controllers import TasksController
+
+    metrics = TasksController.get_queue_metrics()
+    if metrics is None:
+        raise click.ClickException('Unable to read the queues')
+    for priority, queue in metrics.items():
+        click.echo(
+            f'{priority} ({queue["queue"]}): {queue["depth"]} waiting, oldest for {queue["oldest_wait"]:.1f}s | '
+            f'{queue["started"]} started, average wait {queue["average_wait"]:.2f}s, '
+            f'last wait {queue["last_wait"]:.2f}s | {queue["dropped"]} dropped past their deadline'
+        )
+
+
+@app.cli.command('poll-chats')
+@click.option('--once', is_flag=True, help='Poll a single time and quit')
+def poll_chats(once):
+    """Answer the active conversations of the chats API, set in CHATS_URL"""
+    from .controllers import ChatsController
+
+    ChatsController.run(once=once)
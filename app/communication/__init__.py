@@ -10,4 +10,5 @@ from .messages import *
 app_communication = {
     Messages.__name__: Messages,
     EmailCommunication.__name__: EmailCommunication,
+    MailDispatcher.__name__: MailDispatcher,
 }
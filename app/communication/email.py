@@ -4,29 +4,156 @@
 This module is for email communication
 """
 
-import logging
+import sys
+import queue
+import threading
 
-from logging.handlers import SMTPHandler
 from flask import Flask, current_app
 from flask_mail import Message
-from threading import Thread
 from app import mail
 
 
+class MailDispatcher:
+    """
+    Sends emails from a bounded queue through a fixed number of sender threads, capping the SMTP sessions open at once.
+    Each sender keeps its connection (from mail.connect()) open while messages keep coming, sending up to batch_size
+    messages per connection, so a burst costs a handful of TLS handshakes rather than one per email.
+    A connection left idle for idle_timeout seconds is closed
+    """
+
+    def __init__(self, app: Flask, concurrency=2, batch_size=50, idle_timeout=5.0, max_size=1000):
+        """
+        :param app: Application, whose mail settings are used by the senders
+        :param concurrency: Number of sender threads i.e. maximum number of SMTP sessions at once
+        :param batch_size: Maximum number of messages sent over a single connection
+        :param idle_timeout: Seconds a connection is kept open waiting for more messages
+        :param max_size: Maximum number of messages waiting, beyond which messages are refused
+        """
+        self.app = app
+        self.concurrency = max(1, concurrency or 1)
+        self.batch_size = max(1, batch_size or 1)
+        self.idle_timeout = idle_timeout
+        # Items are tuples of the message and the delivery of a caller waiting on it, if any
+        self.queue = queue.Queue(maxsize=max_size or 0)
+        self.counters = {'sent': 0, 'failed': 0, 'refused': 0, 'connections': 0}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    @classmethod
+    def from_config(cls, app: Flask):
+        return cls(
+            app,
+            concurrency=app.config.get('MAIL_CONCURRENCY', 2),
+            batch_size=app.config.get('MAIL_BATCH_SIZE', 50),
+            idle_timeout=app.config.get('MAIL_IDLE_TIMEOUT', 5.0),
+            max_size=app.config.get('MAIL_QUEUE_SIZE', 1000),
+        )
+
+    @property
+    def stats(self) -> dict:
+        """Delivery counters and number of messages waiting"""
+        return dict(self.counters, waiting=self.queue.qsize())
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.concurrency:
+                thread = threading.Thread(target=self.run, name=f'mail-{len(self.threads)}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def add(self, msg: Message, wait: bool = False, timeout: float = 60):
+        """
+        Queue a message for sending
+        :param msg: The message
+        :param wait: Whether to wait for the message to be sent e.g. from background tasks.
+        If the queue is full, a waiting caller sends the message over a connection of its own
+        :param timeout: Seconds to wait for the message to be sent
+        :return: Status code. 0 -> Queued (or sent, when waiting), 1 -> Queue is full or sending failed
+        """
+        self.start()
+        delivery = {'event': threading.Event(), 'status': 1} if wait else None
+        try:
+            self.queue.put_nowait((msg, delivery))
+        except queue.Full:
+            self.count('refused')
+            if not wait:
+                return 1
+            mail.send(msg)
+            return 0
+        if not wait:
+            return 0
+        delivery['event'].wait(timeout)
+        return delivery['status']
+
+    def run(self):
+        with self.app.app_context():
+            item = None
+            while True:
+                item = item or self.queue.get()
+                connected, following = False, None
+                try:
+                    with mail.connect() as connection:
+                        connected = True
+                        self.count('connections')
+                        following = self.send_batch(connection, item)
+                except Exception as err:
+                    self.app.logger.exception(f'Error sending emails\n{err}', exc_info=sys.exc_info())
+                    if not connected:
+                        # The mail server cannot be reached. The message is not retried and its caller is told at once
+                        self.done(item, 1)
+                item = following
+
+    def send_batch(self, connection, item):
+        """
+        Send the message, then the messages waiting, over the connection, up to batch_size messages
+        :return: The next message, to be sent over a fresh connection, if the batch is full, otherwise None
+        """
+        for _ in range(self.batch_size):
+            try:
+                connection.send(item[0])
+                self.done(item, 0)
+            except Exception as err:
+                self.done(item, 1)
+                if not self.recoverable(err):
+                    raise
+                self.app.logger.exception(f'Error sending email {item[0].subject}\n{err}', exc_info=sys.exc_info())
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                return None
+        return item
+
+    @staticmethod
+    def recoverable(err) -> bool:
+        """Whether the connection can still be used after failing to send a message"""
+        import smtplib
+        return isinstance(err, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError))
+
+    def done(self, item, status):
+        self.count('failed' if status else 'sent')
+        msg, delivery = item
+        if delivery is not None:
+            delivery['status'] = status
+            delivery['event'].set()
+
+
 class EmailCommunication:
     """
     This class will support email capabilities
     """
 
-    # this function makes sending email asynchronous(scheduled to run in background)
-    # freeing the send_email() to return immediately
-    # so that the application can continue running concurrently with the email being sent
-    @staticmethod
-    def send_async_email(app, msg):
-        # The application context that is created with the with app.app_context() call
-        # makes the application instance accessible via the current_app variable from Flask.
-        with app.app_context():
-            mail.send(msg)
+    # Dispatcher of the emails sent by this process, created on first use
+    DISPATCHER = None
+
+    @classmethod
+    def dispatcher(cls) -> MailDispatcher:
+        if cls.DISPATCHER is None:
+            cls.DISPATCHER = MailDispatcher.from_config(current_app._get_current_object())
+        return cls.DISPATCHER
 
     # noinspection PyProtectedMember,PyUnresolvedReferences
     @classmethod
@@ -41,8 +168,8 @@ class EmailCommunication:
         :param html_body: HTML version of the email
         :param headers: A dictionary of additional headers for the message
         :param attachments: List of tuples consisting of name, media type and data of files to be sent in email
-        :param sync: Send the email in the foreground if the email is being sent from background task
-        :return: None
+        :param sync: Wait for the email to be sent e.g. if the email is being sent from background task
+        :return: Status code. 0 -> Sent or queued, 1 -> Failure
         """
         if recipients and type(recipients) == list:
             msg = Message(subject, sender=sender, recipients=recipients)
@@ -57,41 +184,22 @@ class EmailCommunication:
                     # arguments of this method are filename, media type and actual file data
                     # these arguments define an attachment
                     msg.attach(*attachment)
-            if sync:
-                mail.send(msg)
-            else:
-                # Here, we start a background thread for email being sent
-                # which is much less resource intensive than starting a new process
-                Thread(target=cls.send_async_email, args=(current_app._get_current_object(), msg)).start()
+            # Emails are sent by the dispatcher's threads over pooled connections,
+            # so that the application can continue running concurrently with the email being sent
+            if cls.dispatcher().add(msg, wait=sync):
+                current_app.logger.error(f'Email {subject} not sent' if sync else f'Email {subject} not queued')
+                return 1
+            return 0
+        return 1
 
     @staticmethod
     def send_error_email(app: Flask):
         """
         Let us email errors to the developers and administrators
-        :return: None
+        Errors are not emailed one by one, but grouped in digests sent in the background, see ErrorAlertHandler
+        :return: The handler sending the digests, or None if emailing errors is disabled
         """
-        # if app is running without debug mode
-        if not app.debug:
-            # allow sending logs by email only if mail server has been set
-            if app.config.get('MAIL_SERVER'):
-                auth = None
-                # receive email server credentials, if any
-                if app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD']:
-                    auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-                secure = None
-                # set up secure email traffic transport
-                if app.config['MAIL_USE_TLS']:
-                    secure = ()
-                # SMTPHandler from logging enables sending logs to admins and tech support by email
-                recipients = app.config['TECH_MAIL_USERNAME']
-                mail_handler = SMTPHandler(
-                    mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-                    fromaddr=app.config['MAIL_SERVER'],
-                    toaddrs=recipients,
-                    subject='InfinitePay System Failure',
-                    credentials=auth,
-                    secure=secure,
-                )
-                # ensure only errors are reported
-                mail_handler.setLevel(logging.ERROR)
-                app.logger.addHandler(mail_handler)
+        from ..utils import configure_logging
+
+        configure_logging(app)
+        return getattr(app, 'error_alerts', None)
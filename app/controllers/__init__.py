@@ -5,9 +5,16 @@ This package shall contain the classes containing the logic that manipulates the
 """
 
 from .tasks import *
+from .intents import *
+from .state import *
 from .sockets import *
+from .chats import *
 
 app_controllers = {
     TasksController.__name__: TasksController,
     SocketsController.__name__: SocketsController,
+    ChatsController.__name__: ChatsController,
+    IntentRegistry.__name__: IntentRegistry,
+    Intent.__name__: Intent,
+    ConversationState.__name__: ConversationState,
 }
@@ -0,0 +1,205 @@
+# app/controllers/chats.py
+
+"""
+This module integrates the external chats (conversations) API.
+Active conversations are polled, their new messages run through the bot and the replies sent back
+"""
+
+import json
+import time
+
+from flask import current_app
+
+from .sockets import SocketsController
+from ..utils import system_logging, UpstreamUnavailable
+
+
+class ChatsController:
+    """
+    Poller of the chats API.
+    For every active conversation, the ID of the last message handled (its cursor) is kept in Redis,
+    so that no message is handled twice, even across restarts and pollers.
+    A conversation is locked while being handled, and its cursor is only ever written under that lock.
+    The replies not sent yet wait in its outbox, so that a failed send is retried without running the turn again,
+    and the replies sent are remembered until the API lists them, so that the bot never answers itself
+    """
+
+    HEADERS = {'authorization': 'teste'}
+
+    @staticmethod
+    def cursors_key():
+        return f'{current_app.config["REDIS_ROOT"]}_chats_cursors'
+
+    @staticmethod
+    def outbox_key(uid: str):
+        """Redis list of the replies to the conversation not sent yet, oldest first"""
+        return f'{current_app.config["REDIS_ROOT"]}_chats_outbox:{uid}'
+
+    @staticmethod
+    def sent_key(uid: str):
+        """Redis list of the replies sent to the conversation, not yet seen among its messages"""
+        return f'{current_app.config["REDIS_ROOT"]}_chats_sent:{uid}'
+
+    @classmethod
+    def request(cls, endpoint: str, body: dict = None, idempotent: bool = True) -> dict or None:
+        """
+        Call an endpoint of the chats API
+        :return: The JSON response or None in case of error
+        """
+        url = f'{current_app.config.get("CHATS_URL")}/{endpoint}'
+        try:
+            response = current_app.http.post(url, data=body or {}, headers=cls.HEADERS, idempotent=idempotent)
+        except UpstreamUnavailable as err:
+            system_logging(err, exception=True)
+            return None
+        if not response:
+            system_logging(f"{url} RESPONSE: {response.text}\nSTATUS CODE: {response.status_code}", exception=True)
+            return None
+        return response.json()
+
+    @classmethod
+    def poll(cls):
+        """
+        Poll the active conversations once.
+        New conversations are fetched straight away, known ones once CHATS_REFRESH_INTERVAL has passed since their
+        last check. At most CHATS_CONCURRENCY conversations are handled at the same time
+        :return: Number of conversations checked
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        result = cls.request('conversations')
+        if not result:
+            return 0
+        active = [str(conversation_id) for conversation_id in result.get('conversation_ids') or []]
+
+        app = current_app._get_current_object()
+        key = cls.cursors_key()
+        # All cursors are read in a single round trip
+        cursors = {
+            field.decode(): json.loads(value) for field, value in (app.redis.hgetall(key) or {}).items()
+        }
+        now = time.time()
+        refresh = app.config.get('CHATS_REFRESH_INTERVAL', 30)
+        due = [uid for uid in active if now - cursors.get(uid, {}).get('checked_at', 0) >= refresh]
+
+        def check(uid):
+            with app.app_context():
+                try:
+                    cls.handle_conversation(uid)
+                except Exception as err:
+                    # A failed conversation keeps its saved cursor, without holding back the others.
+                    # Turns committed before the failure have already moved the cursor past their messages
+                    system_logging(f'Unhandled exception handling chat {uid}\n{err}', exception=True)
+
+        # Cursors are saved by handle_conversation, under the conversation's lock, and never from this snapshot,
+        # which a poller holding the lock may have moved past already
+        with ThreadPoolExecutor(max_workers=app.config.get('CHATS_CONCURRENCY', 16)) as executor:
+            list(executor.map(check, due))
+
+        # Forget conversations that are no longer active
+        finished = set(cursors) - set(active)
+        if finished:
+            app.redis.hdel(key, *finished)
+        return len(due)
+
+    @classmethod
+    def send_outbox(cls, uid: str) -> bool:
+        """
+        Send the replies waiting in the conversation's outbox, in order, stopping at the first failure
+        :return: Whether the outbox is empty
+        """
+        outbox = cls.outbox_key(uid)
+        while True:
+            reply = current_app.redis.lindex(outbox, 0)
+            if reply is None:
+                return True
+            sent = cls.request('send_message', {'conversation_id': uid, 'message': reply.decode()}, idempotent=False)
+            if not sent or str(sent.get('sent')).lower() != 'true':
+                return False
+            pipe = current_app.redis.pipeline()
+            pipe.lpop(outbox)
+            pipe.rpush(cls.sent_key(uid), reply)
+            pipe.expire(cls.sent_key(uid), int(current_app.config.get('CONVERSATION_STATE_TTL', 24 * 60 * 60)))
+            pipe.execute()
+
+    @classmethod
+    def is_own_message(cls, uid: str, msg: dict) -> bool:
+        """
+        Whether the message is a reply the bot sent, as the API lists those among the conversation's messages.
+        The API does not say who wrote a message, so a message is the bot's if its text is that of a reply sent
+        and not seen yet, which it then stops waiting for
+        """
+        return bool(current_app.redis.lrem(cls.sent_key(uid), 1, msg.get('text') or ''))
+
+    @classmethod
+    def save_cursor(cls, uid: str, cursor: str, replies: list = ()):
+        """Move the conversation's cursor, putting the replies of the messages it moved past in the outbox"""
+        pipe = current_app.redis.pipeline()
+        if replies:
+            pipe.rpush(cls.outbox_key(uid), *replies)
+        pipe.hset(cls.cursors_key(), uid, json.dumps({'message_id': cursor, 'checked_at': time.time()}))
+        pipe.execute()
+
+    @classmethod
+    def handle_conversation(cls, uid: str):
+        """
+        Run the messages of the conversation received after its cursor through the bot, in order,
+        and send the replies back
+        Once a message's turn is committed, its replies are put in the outbox and the cursor moved past it, together,
+        so that the turn is never run again. Replies that could not be sent are retried on the next poll,
+        before any newer message is handled
+        :param uid: ID of the conversation in the chats API
+        :return: The ID of the last message handled, the new cursor, or None if the conversation was not handled
+        """
+        lock = current_app.redis.lock(SocketsController.lock_key(uid), timeout=60)
+        # Skip a conversation being handled by another poller, rather than wait for it
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            if not cls.send_outbox(uid):
+                return None
+            info = cls.request('conversation_info', {'conversation_id': uid})
+            if not info:
+                return None
+            # Read under the lock, so that it is the latest cursor
+            saved = current_app.redis.hget(cls.cursors_key(), uid)
+            cursor = json.loads(saved).get('message_id') if saved else None
+            messages = sorted(info.get('messages') or [], key=lambda msg: int(msg.get('created_at') or 0))
+            ids = [msg.get('message_id') for msg in messages]
+            pending = messages[ids.index(cursor) + 1:] if cursor in ids else messages
+            for msg in pending:
+                # Keep the conversation locked for as long as its messages are being handled
+                lock.reacquire()
+                if cls.is_own_message(uid, msg):
+                    cursor = msg.get('message_id')
+                    continue
+                replies = SocketsController.answer(msg.get('text') or '', uid)
+                if replies[0].startswith('Unable to continue'):
+                    # The turn was not committed: the message is handled again on the next poll
+                    break
+                cursor = msg.get('message_id')
+                cls.save_cursor(uid, cursor, replies)
+                if not cls.send_outbox(uid):
+                    break
+            # Record the check, and the bot's own messages skipped after the last turn
+            cls.save_cursor(uid, cursor)
+            return cursor
+        finally:
+            try:
+                lock.release()
+            except Exception as err:
+                system_logging(f'Lock of chat {uid} expired while being handled\n{err}', exception=True)
+
+    @classmethod
+    def run(cls, once: bool = False):
+        """Poll the chats API every CHATS_POLL_INTERVAL seconds"""
+        interval = current_app.config.get('CHATS_POLL_INTERVAL', 5)
+        while True:
+            start = time.monotonic()
+            try:
+                cls.poll()
+            except Exception as err:
+                system_logging(f'Unhandled exception polling chats\n{err}', exception=True)
+            if once:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
@@ -0,0 +1,138 @@
+# app/controllers/intents.py
+
+"""
+This module contains the registry of the problems (intents) that the bot can handle.
+Each intent declares its keywords, the identifier to ask the client for, where to look the identifier up
+(an HTTP endpoint or a table column) and how to present what was found
+"""
+
+import json
+
+from ..utils import system_logging, IntentMatcher
+
+
+class Intent:
+    """
+    A problem type the bot can handle.
+    An intent is answered either from an API (url and field), from the database (model and column)
+    or from several other intents at once (lookups), which all receive the same identifier
+    """
+
+    def __init__(self, name: str, keywords, prompt: str, url: str = None, field: str = None, model=None,
+                 column: str = None, template: str = None, priority: int = 0, ttl: int = 0, lookups: list = None):
+        """
+        :param name: Unique name of the intent e.g. tracking
+        :param keywords: Words and phrases that identify the intent in a message
+        :param prompt: Name of the identifier requested from the client e.g. Sale ID
+        :param url: Endpoint to POST the identifier to, for API backed intents
+        :param field: Name of the body field that carries the identifier to the endpoint
+        :param model: Model to query, for database backed intents
+        :param column: Column of the model to filter by the identifier
+        :param template: Optional format string for the API result, using the keys of the result
+        :param priority: Precedence of the intent when a message matches several intents equally
+        :param ttl: Seconds an API result may be served from cache. 0 means it is always looked up
+        :param lookups: Intents whose data sources are all queried, concurrently, to answer this intent
+        """
+        self.name = name
+        self.keywords = set(keywords or ())
+        self.prompt = prompt
+        self.url = url
+        self.field = field
+        self.model = model
+        self.column = column
+        self.template = template
+        self.priority = priority or 0
+        self.ttl = ttl or 0
+        self.lookups = list(lookups or ())
+
+    @property
+    def is_composite(self) -> bool:
+        return bool(self.lookups)
+
+    @property
+    def is_api(self) -> bool:
+        return bool(self.url and self.field)
+
+    @property
+    def is_table(self) -> bool:
+        return bool(self.model is not None and self.column)
+
+    def serialize(self, records) -> list:
+        """Convert the records found in the database, a query or a list, using the model's own retrieve helper"""
+        serializer = getattr(self.model, f'retrieve_{self.model.__tablename__}', None)
+        return serializer(records) if serializer else []
+
+    def format(self, result: dict) -> str:
+        """Present the result of an API lookup to the client"""
+        if self.template:
+            try:
+                return self.template.format_map(result)
+            except (KeyError, IndexError, ValueError) as err:
+                system_logging(f'Intent {self.name} template does not fit API response {result}\n{err}')
+        return "\n".join(f'{key.replace("_", " ").title()}: {value}' for key, value in result.items() if value)
+
+    def __repr__(self):
+        return f'<Intent {self.name}>'
+
+
+class IntentRegistry:
+    """
+    Holds the intents keyed by name, together with the keyword matcher built from them.
+    Registration swaps in new copies, so lookups never see a half updated registry
+    """
+
+    def __init__(self, intents=()):
+        self.intents = {}
+        self.matcher = IntentMatcher({})
+        for intent in intents:
+            self.register(intent)
+
+    def register(self, *intents: Intent):
+        """Add intents, replacing any existing intents of the same names"""
+        registered = dict(self.intents)
+        for intent in intents:
+            registered[intent.name] = intent
+        self.matcher = IntentMatcher(
+            {name: intent.keywords for name, intent in registered.items()},
+            {name: intent.priority for name, intent in registered.items()},
+        )
+        self.intents = registered
+
+    def load(self, path: str):
+        """
+        Register intents defined in a JSON file, which holds a list of objects with the arguments of Intent.
+        Database backed intents give the name of the model e.g. {"model": "SaleModel", "column": "id_sale"}
+        and composite intents give the definitions of their lookups in the same format
+        :param path: Path to the JSON file
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        try:
+            from .. import models
+
+            def build(definition):
+                if definition.get('model'):
+                    definition['model'] = getattr(models, definition['model'])
+                definition['lookups'] = [build(lookup) for lookup in definition.get('lookups') or ()]
+                return Intent(**definition)
+
+            with open(path) as fp:
+                definitions = json.load(fp)
+
+            self.register(*[build(definition) for definition in definitions])
+            return 0
+        except Exception as err:
+            system_logging(f'Error loading intents from {path}\n{err}', exception=True)
+            return 1
+
+    def get(self, name):
+        return self.intents.get(name)
+
+    def match(self, message: str):
+        """Return the intent that the message is about, or None"""
+        return self.intents.get(self.matcher.match(message))
+
+    def __contains__(self, name):
+        return name in self.intents
+
+    def __iter__(self):
+        return iter(self.intents.values())
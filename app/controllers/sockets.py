@@ -4,47 +4,54 @@
 This module will contain methods that implement logic for the conversation
 """
 
-import re
 import uuid
-import requests
 
-from ..utils import system_logging
+from flask import current_app
+
+from .intents import Intent, IntentRegistry
+from .state import ConversationState
+from ..utils import system_logging, task_config, UpstreamUnavailable
 from ..models import ConversationModel, MessageModel, ActionModel, SaleModel, TransactionModel, ReceiptModel
+from ..models import WriteBehindBuffer, time_now, unit_of_work
 
 
 class SocketsController:
     LOGISTICS_URL = "https://logistics-api-dot-active-thunder-329100.rj.r.appspot.com"
     TELECOMS_URL = "https://telecom-api-dot-active-thunder-329100.rj.r.appspot.com"
 
-    KEYWORDS = {
-        "receipt": {"account", "bank", "receipt"},
-        "chip_status": {"chip", "machine"},
-        "zip_code": {"zip", "address", "home"},
-        "sales": {"sale"},
-        "transactions": {'transaction'},
-        "tracking": {"track"},
-    }
-
-    IDS = {
-        "tracking": 'Sale ID',
-        "zip_code": 'Zip Code',
-        "chip_status": 'Chip ID',
-        "sales": "Sale ID",
-        "transactions": 'Transaction ID',
-        "receipt": 'Merchant ID',
-    }
-
-    TABLES = {
-        "sales": SaleModel,
-        "transactions": TransactionModel,
-        "receipt": ReceiptModel,
-    }
-
-    APIS = {
-        "tracking": 'tracking',
-        "zip_code": 'zip_code',
-        "chip_status": 'chip_status',
-    }
+    # Problems the bot can handle. More can be registered at startup from the file set in INTENTS_FILE
+    INTENTS = IntentRegistry([
+        Intent("receipt", {"account", "bank", "receipt"}, 'Merchant ID', model=ReceiptModel, column='merchant_id'),
+        Intent(
+            "chip_status", {"chip", "machine"}, 'Chip ID', url=f'{TELECOMS_URL}/chip_status', field='chip_id', ttl=120,
+            template="Chip with ID {id} is {status}.\nMessage is '{description}'",
+        ),
+        Intent(
+            "zip_code", {"zip", "address", "home"}, 'Zip Code', url=f'{LOGISTICS_URL}/zip_code', field='zip_code',
+            ttl=24 * 60 * 60,
+        ),
+        Intent("sales", {"sale"}, "Sale ID", model=SaleModel, column='id_sale'),
+        Intent("transactions", {'transaction'}, 'Transaction ID', model=TransactionModel, column='transaction_id'),
+        Intent(
+            # When a message hits several intents equally, the more specific ones take precedence
+            "tracking", {"track"}, 'Sale ID', url=f'{LOGISTICS_URL}/tracking', field='id_sale', priority=1, ttl=300,
+            template="The products is {status} with a delivery forecast for {delivery_forecast} "
+                     "to be delivered to Zip Code {destination_zip_code}",
+        ),
+        Intent(
+            # A missing payment involves the merchant's receipts, transactions and sales, all looked up at once
+            "payment", {"payment", "money", "paid"}, 'Merchant ID', priority=1, lookups=[
+                Intent("receipt", (), 'Merchant ID', model=ReceiptModel, column='merchant_id'),
+                Intent("transactions", (), 'Merchant ID', model=TransactionModel, column='merchant_id'),
+                Intent("sales", (), 'Merchant ID', model=SaleModel, column='merchant_id'),
+            ],
+        ),
+    ])
+
+    # Pool for running the lookups of composite intents concurrently, created on first use
+    EXECUTOR = None
+    # Buffer for writing messages behind, when MESSAGE_WRITE_BEHIND is set, created on first use
+    BUFFER = None
 
     @staticmethod
     def retrieve_conversation(conversation_id):
@@ -53,102 +60,282 @@ class SocketsController:
 
         conversation = ConversationModel.query.filter(ConversationModel.conversation_id == conversation_id).first()
         if not conversation:
-            conversation = ConversationModel(conversation_id=conversation_id)
+            timestamp = time_now()
+            conversation = ConversationModel(
+                conversation_id=conversation_id, last_message_sender='system', last_message_at=timestamp,
+            )
             if conversation.save():
                 system_logging('Error creating conversation. Please review', exception=True)
                 return None
             first_message = 'Welcome to Infinite Pay support center. How can we be of assistance?'
-            MessageModel(conversation_id=conversation_id, body=first_message, sender='system').save()
+            MessageModel(
+                conversation_id=conversation_id, body=first_message, sender='system', timestamp=timestamp,
+            ).save()
 
         return conversation
 
+    @staticmethod
+    def retrieve_history(uid: str, cursor: str = None) -> dict:
+        """
+        Retrieve a page of the conversation's history, the latest messages if no cursor is given.
+        Older pages never change, since messages are only ever appended, so they are served from cache
+        :param uid: ID of the conversation
+        :param cursor: Cursor of the page, as returned with the previous page
+        :return: Dictionary with the messages of the page, oldest first, and the cursor of the next (older) page
+        """
+        limit = current_app.config.get('HISTORY_PAGE_SIZE', 50)
+
+        def fetch():
+            messages, older = MessageModel.retrieve_page(uid, limit=limit, cursor=cursor)
+            return dict(messages=messages, cursor=older)
+
+        if not cursor:
+            return fetch()
+        return current_app.cache.get_or_fetch(
+            f'history:{uid}:{limit}:{cursor}', current_app.config.get('HISTORY_CACHE_TTL', 600), fetch,
+        )
+
     @classmethod
-    def save_message(cls, message: str, uid: str, sender: str = None):
-        if not cls.retrieve_conversation(uid):
+    def save_message(cls, message: str, uid: str, sender: str = None, checked: bool = False,
+                     committed: bool = False):
+        """
+        Save a message of the conversation
+        :param checked: Whether the conversation is already known to exist, sparing a query
+        :param committed: Whether the conversation is known to be committed, e.g. has its state saved, so that the
+        message can be written behind without the risk of reaching the database before its conversation
+        :return: Error message for the client or None if successful
+        """
+        if not checked and not cls.retrieve_conversation(uid):
+            return 'Unable to continue. Please refresh page'
+        body = message if message or type(message) == str else ''
+        sender = sender if sender or type(sender) == str else 'client'
+        timestamp = time_now()
+        # Keep track of who spoke last, so that unanswered conversations can be found without reading messages
+        if ConversationModel.touch(uid, sender, timestamp):
             return 'Unable to continue. Please refresh page'
+        if committed and current_app.config.get('MESSAGE_WRITE_BEHIND'):
+            # Group committed with the messages of other conversations by the write-behind buffer
+            values = dict(conversation_id=uid, body=body, sender=sender, timestamp=timestamp)
+            if not cls.message_buffer().add(MessageModel, values):
+                return None
         _message = MessageModel()
         _message.conversation_id = uid
-        _message.body = message if message or type(message) == str else ''
-        _message.sender = sender if sender or type(sender) == str else 'client'
+        _message.body = body
+        _message.sender = sender
+        _message.timestamp = timestamp
         if _message.save():
             system_logging('Error saving message. Please review', exception=True)
             return 'Unable to continue. Please refresh page'
         return None
 
+    @staticmethod
+    def mailbox_key(uid: str) -> str:
+        """Redis list of the conversation's messages waiting to be processed"""
+        return f'{current_app.config["REDIS_ROOT"]}_mailbox:{uid}'
+
+    @staticmethod
+    def processing_key(uid: str) -> str:
+        """Redis list of the conversation's message being answered, kept there until its turn is committed"""
+        return f'{current_app.config["REDIS_ROOT"]}_mailbox_processing:{uid}'
+
+    @staticmethod
+    def lock_key(uid: str) -> str:
+        """Redis lock held by the worker answering the conversation"""
+        return f'{current_app.config["REDIS_ROOT"]}_conversation:{uid}'
+
+    @classmethod
+    def enqueue_message(cls, message, uid):
+        """
+        Save the client's message and queue it for processing by a worker, see TaskUtil.process_conversation
+        Messages are put in the conversation's mailbox, so that they are answered in order
+        :return: Error message for the client or None if successful
+        """
+        with unit_of_work() as work:
+            known = ConversationState.exists(uid)
+            msg = cls.save_message(message, uid, checked=known, committed=known)
+        if msg or work.status:
+            return msg or 'Unable to continue. Please refresh page'
+        try:
+            current_app.redis.rpush(cls.mailbox_key(uid), message)
+            cls.process_mailbox(uid)
+        except Exception as err:
+            system_logging(f'Error queueing message of conversation {uid}\n{err}', exception=True)
+            return 'Unable to continue. Please refresh page'
+        return None
+
+    @staticmethod
+    def process_mailbox(uid: str):
+        """Queue a job answering the messages in the conversation's mailbox, see TaskUtil.process_conversation"""
+        current_app.reply_queue.enqueue(
+            task_config['process_conversation'], uid, job_timeout=60, result_ttl=0, failure_ttl=24 * 60 * 60,
+        )
+
     @classmethod
-    def initiate_conversation(cls, message, uid, is_saved: bool = False):
+    def answer(cls, message, uid, is_saved: bool = False) -> list:
+        """
+        Run a whole conversational turn: save the client's message, respond to it and save the replies,
+        all in a single transaction
+        :param message: Message from the client
+        :param uid: ID of the conversation
+        :param is_saved: Whether the client's message has already been saved
+        :return: List of the replies to be sent to the client, in order
+        """
+        import re
+        replies = []
+        state = ConversationState.load(uid)
+        with unit_of_work() as work:
+            response = cls.initiate_conversation(message, uid, is_saved=is_saved, state=state)
+            cls.save_message(response, uid, sender='system', checked=True, committed=state.cached)
+            replies.append(response)
+            if re.search("Thank", response):
+                intro = "Welcome to Infinite Pay support center. How can we be of assistance?"
+                cls.save_message(intro, uid, sender='system', checked=True, committed=state.cached)
+                replies.append(intro)
+        if work.status:
+            # The state may be ahead of the database, so it is reloaded from there on the next message
+            state.invalidate()
+            return ['Unable to continue. Please refresh page']
+        # The state of a conversation that could not be found or created is not saved
+        if not replies[0].startswith('Unable to continue'):
+            state.save()
+        return replies
+
+    @classmethod
+    def initiate_conversation(cls, message, uid, is_saved: bool = False, state: ConversationState = None):
+        """
+        Respond to the client's message according to the state of the conversation
+        :param state: State of the conversation, updated in place. The caller saves it once the turn is committed
+        """
+        state = state or ConversationState.load(uid)
         if not is_saved:
-            msg = cls.save_message(message, uid)
+            msg = cls.save_message(message, uid, checked=state.cached, committed=state.cached)
             if msg:
                 return msg
-        action = ActionModel.query.filter_by(conversation_id=uid, completed=False).first()
-        if not action:
-            return cls.respond_message(message, uid)
+        intent = cls.INTENTS.get(state.action) if state.action else None
+        if not intent:
+            return cls.respond_message(message, uid, state)
         else:
-            name, response = action.name, None
-            if name in cls.APIS:
-                response = cls.request_api(name, message)
-            elif name in cls.TABLES:
-                response = cls.request_database(name, message)
+            try:
+                response = cls.request(intent, message)
+            except UpstreamUnavailable as err:
+                # Keep the action open so that the client can simply resend the identifier
+                system_logging(err, exception=True)
+                return f"Sorry, we are unable to check your {intent.prompt} at the moment\n" \
+                       f"Please try again in a few minutes"
             if not response:
-                return f"Oops!! We fear that you may have entered incorrect identifier\nCarefully re-enter correct {cls.IDS[name]}\n"
+                state.retries += 1
+                return f"Oops!! We fear that you may have entered incorrect identifier\nCarefully re-enter correct {intent.prompt}\n"
             else:
-                action.completed = True
-                if not action.save():
+                if not ActionModel.complete(state.action_id):
+                    state.finish()
                     return f"{response}\nThank you for your reaching out and reach out to us when you have an issue"
-            return f"Please provide your {cls.IDS[name]}"
+            return f"Please provide your {intent.prompt}"
 
     @classmethod
-    def respond_message(cls, message, uid):
+    def respond_message(cls, message, uid, state: ConversationState = None):
         # This marks a new phase of the conversation
-        keyword = None
         # Look for keywords
-        for action, keywords in cls.KEYWORDS.items():
-            for word in keywords:
-                if re.search(word, message):
-                    keyword = action
-                    break
+        intent = cls.INTENTS.match(message)
         # If not keyword found, show them list of options
-        if not keyword:
+        if not intent:
             message = 'For better service delivery, please an option from the following options\n'
-            for i, key in enumerate(cls.KEYWORDS):
-                message = f'{message}\n{key.replace("_", " ").title()}'
+            for option in cls.INTENTS:
+                message = f'{message}\n{option.name.replace("_", " ").title()}'
         else:
-            ActionModel(id=uuid.uuid4(), conversation_id=uid, name=keyword).save()
-            message = f"Please provide your {cls.IDS[keyword]}"
+            action = ActionModel(id=uuid.uuid4(), conversation_id=uid, name=intent.name)
+            if not action.save() and state:
+                state.start(action)
+            message = f"Please provide your {intent.prompt}"
         return message
 
     @classmethod
-    def request_api(cls, name, identifier):
-        url, body = None, {}
-        keys = list(cls.APIS.keys())
-        if name == keys[0]:
-            url = f'{cls.LOGISTICS_URL}/{cls.APIS[name]}'
-            body = {"id_sale": identifier}
-        elif name == keys[1]:
-            url = f'{cls.LOGISTICS_URL}/{cls.APIS[name]}'
-            body = {"zip_code": identifier}
-        elif name == keys[2]:
-            url = f'{cls.TELECOMS_URL}/{cls.APIS[name]}'
-            body = {"chip_id": identifier}
-        return cls.retrieve_api(url, body=body, action=name)
+    def request(cls, intent: Intent, identifier):
+        """
+        Look up the identifier from the data source(s) of the intent
+        :raises UpstreamUnavailable: If the intent's API is down
+        :return: Response for the client or None if nothing was found
+        """
+        if intent.is_composite:
+            return cls.request_many(intent, identifier)
+        if intent.is_api:
+            return cls.request_api(intent, identifier)
+        if intent.is_table:
+            return cls.request_database(intent, identifier)
+        return None
 
     @classmethod
-    def request_database(cls, name, id_: str):
-        keys = list(cls.TABLES.keys())
+    def request_many(cls, intent: Intent, identifier):
+        """
+        Run all lookups of a composite intent concurrently and compose a single response,
+        once all of them complete or the deadline passes.
+        Lookups that fail or run late are reported inline, without holding back the others
+        :return: Response for the client or None if none of the lookups found anything
+        """
+        from concurrent.futures import wait
+
+        app = current_app._get_current_object()
+
+        def lookup(child):
+            # Each lookup runs in its own (green) thread and thus needs its own context and database session
+            with app.app_context():
+                return cls.request(child, identifier)
+
+        futures = {child: cls.executor().submit(lookup, child) for child in intent.lookups}
+        wait(futures.values(), timeout=app.config.get('LOOKUP_DEADLINE', 10))
+
+        found, sections = False, []
+        for child, future in futures.items():
+            title = child.name.replace("_", " ")
+            if not future.done():
+                future.cancel()
+                sections.append(f"Your {title} check is taking longer than expected. Please ask again later")
+            elif future.exception():
+                system_logging(f'Error looking up {child.name} for {intent.name}\n{future.exception()}')
+                sections.append(f"We are unable to check your {title} at the moment")
+            elif not future.result():
+                sections.append(f"No {title} was found for your {intent.prompt}")
+            else:
+                found = True
+                sections.append(future.result())
+        return "\n\n".join(sections) if found else None
+
+    @classmethod
+    def executor(cls):
+        """Shared pool that runs concurrent lookups. Threads are green threads when running under eventlet"""
+        if cls.EXECUTOR is None:
+            from concurrent.futures import ThreadPoolExecutor
+            cls.EXECUTOR = ThreadPoolExecutor(
+                max_workers=current_app.config.get('LOOKUP_WORKERS', 32), thread_name_prefix='lookup',
+            )
+        return cls.EXECUTOR
+
+    @classmethod
+    def message_buffer(cls) -> WriteBehindBuffer:
+        if cls.BUFFER is None:
+            cls.BUFFER = WriteBehindBuffer(interval=current_app.config.get('MESSAGE_FLUSH_INTERVAL', 0.005))
+        return cls.BUFFER
+
+    @classmethod
+    def request_api(cls, intent: Intent, identifier):
+        # Repeated questions about the same identifier are answered from cache for the intent's TTL
+        # The identifier is normalized once, so that the cached result is that of the identifier looked up
+        identifier = identifier.strip()
+        result = current_app.cache.get_or_fetch(
+            f'{intent.name}:{identifier}',
+            intent.ttl,
+            lambda: cls.retrieve_api(intent.url, body={intent.field: identifier}, action=intent.name),
+        )
+        return intent.format(result) if result else None
+
+    @classmethod
+    def request_database(cls, intent: Intent, id_: str):
         if not id_.isnumeric():
             return None
-        if name == keys[0]:
-            results = cls.TABLES[name].retrieve_sales(cls.TABLES[name].query.filter_by(id_sale=id_).all())
-        elif name == keys[1]:
-            results = cls.TABLES[name].retrieve_transactions(cls.TABLES[name].query.filter_by(transaction_id=id_).all())
-        elif name == keys[2]:
-            results = cls.TABLES[name].retrieve_receipts(cls.TABLES[name].query.filter_by(merchant_id=id_).all())
-        else:
-            results = []
+        column = getattr(intent.model, intent.column)
+        results = intent.serialize(intent.model.query.filter(column == id_))
         if not results:
             return None
-        message = f"The following result was found for your {name} query\n"
+        message = f"The following result was found for your {intent.name} query\n"
         for position, res in enumerate(results):
             message += f'\n<b>Result: {position + 1}</b>\n\n'
             message += "\n".join(
@@ -158,24 +345,22 @@ class SocketsController:
 
     @classmethod
     def retrieve_api(cls, url: str, body: dict, action='') -> dict or None:
+        """
+        Look up data from an upstream API
+        Connections are reused and requests are bounded by timeouts, see HttpClient
+        :raises UpstreamUnavailable: If the upstream is down
+        """
         if not url or not isinstance(url, str):
             return None
 
         if not body or not isinstance(body, dict):
             return None
 
-        response = requests.post(url, data=body, headers={'authorization': 'teste'})
+        response = current_app.http.post(url, data=body, headers={'authorization': 'teste'})
         if not response:
-            system_logging(f"{url} RESPONSE: {response.text}\nSTATUS CODE: {response.status_code}", exception=True)
+            system_logging(
+                f"{action} {url} RESPONSE: {response.text}\nSTATUS CODE: {response.status_code}", exception=True,
+            )
             return None
 
-        result = response.json()
-        keys = list(cls.APIS.keys())
-        if action == keys[0]:
-            return "The products is {} with a delivery forecast for {} to be delivered to Zip Code {}".format(
-                result['status'], result['delivery_forecast'], result['destination_zip_code']
-            )
-        elif action == keys[2]:
-            return f"Chip with ID {result['CHIP37648']} is {result['status']}.\nMessage is \'{result['description']}\'"
-        else:
-            return "\n".join(f'{key.replace("_", " ").title()}: {value}' for key, value in result.items() if value)
+        return response.json()
@@ -0,0 +1,112 @@
+# app/controllers/state.py
+
+"""
+This module keeps the state of every ongoing conversation i.e. the action it is waiting on, in Redis.
+Actions remain saved in the database, which is the source of truth whenever Redis is unavailable
+"""
+
+from flask import current_app
+
+from ..models import ActionModel
+from ..utils import system_logging
+
+
+class ConversationState:
+    """
+    Compact record of where a conversation stands, saved as a Redis hash.
+    A record is only ever saved for a conversation that exists, so finding one spares checking the conversation too
+    """
+
+    FIELDS = ('action_id', 'action', 'retries', 'last_intent')
+
+    def __init__(self, uid: str, action_id: str = None, action: str = None, retries: int = 0,
+                 last_intent: str = None, cached: bool = False):
+        """
+        :param uid: ID of the conversation
+        :param action_id: ID of the pending action in the database
+        :param action: Name of the pending action i.e. of its intent
+        :param retries: Number of identifiers not found for the pending action
+        :param last_intent: Name of the latest intent the client asked about
+        :param cached: Whether the record was found in Redis
+        """
+        self.uid = uid
+        self.action_id = action_id or None
+        self.action = action or None
+        self.retries = int(retries or 0)
+        self.last_intent = last_intent or None
+        self.cached = cached
+
+    @staticmethod
+    def key(uid: str) -> str:
+        return f'{current_app.config["REDIS_ROOT"]}_state:{uid}'
+
+    @classmethod
+    def exists(cls, uid: str) -> bool:
+        """Whether the conversation has its state saved, hence is known to exist"""
+        try:
+            return bool(current_app.redis.exists(cls.key(uid)))
+        except Exception as err:
+            system_logging(f'Error reading state of conversation {uid}\n{err}', exception=True)
+            return False
+
+    @classmethod
+    def load(cls, uid: str):
+        """
+        Retrieve the state of the conversation from Redis, falling back to its pending action in the database
+        """
+        try:
+            record = current_app.redis.hgetall(cls.key(uid))
+        except Exception as err:
+            system_logging(f'Error reading state of conversation {uid}\n{err}', exception=True)
+            record = None
+        if record:
+            record = {field.decode(): value.decode() for field, value in record.items()}
+            return cls(uid, cached=True, **{field: record.get(field) for field in cls.FIELDS})
+        action = ActionModel.pending(uid)
+        if not action:
+            return cls(uid)
+        return cls(uid, action_id=str(action.id), action=action.name, last_intent=action.name)
+
+    def start(self, action: ActionModel):
+        """Wait on a new action"""
+        self.action_id = str(action.id)
+        self.action = self.last_intent = action.name
+        self.retries = 0
+
+    def finish(self):
+        """Clear the pending action once completed"""
+        self.action_id = self.action = None
+        self.retries = 0
+
+    def save(self):
+        """
+        Save the state in Redis, once the changes to the conversation's actions have been committed
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        record = {field: '' if getattr(self, field) is None else str(getattr(self, field)) for field in self.FIELDS}
+        try:
+            pipe = current_app.redis.pipeline()
+            pipe.hset(self.key(self.uid), mapping=record)
+            pipe.expire(self.key(self.uid), int(current_app.config.get('CONVERSATION_STATE_TTL', 24 * 60 * 60)))
+            pipe.execute()
+            self.cached = True
+            return 0
+        except Exception as err:
+            system_logging(f'Error saving state of conversation {self.uid}\n{err}', exception=True)
+            return self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop the state from Redis, so that it is next loaded from the database
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        self.cached = False
+        try:
+            current_app.redis.delete(self.key(self.uid))
+            return 0
+        except Exception as err:
+            system_logging(f'Error dropping state of conversation {self.uid}\n{err}', exception=True)
+            return 1
+
+    def __repr__(self):
+        return f'<ConversationState {self.uid}: {self.action}>'
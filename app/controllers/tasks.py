@@ -1,13 +1,14 @@
 # app/controllers/tasks.py
 
 import rq
+import time
 import uuid
 
 from datetime import datetime
 from flask import current_app
 
 from ..models import TaskModel, ScheduledTaskModel
-from ..utils import task_config, system_logging, TaskUtil
+from ..utils import task_config, task_priority, system_logging, TaskUtil
 
 APP = current_app
 
@@ -45,13 +46,15 @@ class TasksController:
     """
 
     @classmethod
-    def launch_task(cls, name, description, meta=None, *args, **kwargs):
+    def launch_task(cls, name, description, meta=None, *args, priority=None, deadline=None, **kwargs):
         """
         Submit task to RQ queue
         :param name: Task/function name as defined in app/tasks.py
         :param description: Friendly description of the task that can be presented to users
         :param meta: Arbitrary pickle-able data on the job itself
         :param args: Positional arguments to be passed to the task
+        :param priority: Priority class i.e. interactive, default or bulk. Defaults to that of the task in task_priority
+        :param deadline: Seconds from now after which the task is dropped rather than run late. Not set by default
         :param kwargs: Keyword arguments that will be passed to the task
         """
         try:
@@ -61,15 +64,22 @@ class TasksController:
             if name not in task_config:
                 system_logging("Non-existent Task function provided", exception=True)
                 return None
+            priority = priority or task_priority.get(name, 'default')
+            if priority not in APP.queues:
+                system_logging(f"Non-existent priority class {priority} provided", exception=True)
+                return None
 
             from rq import Retry
-            # Submit the job and add it to the queue
+            meta = dict(meta) if meta and type(meta) == dict else {}
+            if deadline:
+                # Checked by the worker when the job is dequeued, see AppWorker
+                meta['deadline'] = time.time() + deadline
+            # Submit the job and add it to the queue of its priority class
             fn = task_config[name]
             # Retry up to 3 times, with configurable intervals between retries
-            job = APP.task_queue.enqueue(
+            job = APP.queues[priority].enqueue(
                 fn, args=args, kwargs=kwargs, job_timeout=30, retry=Retry(3, [10, 30, 60]),
-                on_success=report_success, on_failure=report_failure,
-                meta=meta if meta and type(meta) == dict else {},
+                on_success=report_success, on_failure=report_failure, meta=meta,
             )
             if not job:
                 system_logging("Job has not been queued", exception=True)
@@ -86,26 +96,55 @@ class TasksController:
             return None
 
     @staticmethod
-    def get_tasks_in_progress():
-        """Return the complete list of tasks that are outstanding"""
+    def sync_completed():
+        """
+        Mark the tasks completed since the last sync complete in the database, in a single update
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
         try:
-            tasks = TaskModel.query.filter_by(complete=False).all()
+            key = TaskUtil.completed_key()
+            # Read and clear the set atomically, so that no completion is lost to a concurrent sync
+            pipe = APP.redis.pipeline()
+            pipe.smembers(key)
+            pipe.delete(key)
+            task_ids, _ = pipe.execute()
+            if not task_ids:
+                return 0
+            if TaskModel.mark_complete([task_id.decode() for task_id in task_ids]):
+                # Keep them for the next sync
+                APP.redis.sadd(key, *task_ids)
+                return 1
+            return 0
+        except BaseException as err:
+            system_logging(err)
+            return 1
+
+    @classmethod
+    def get_tasks_in_progress(cls):
+        """Return the complete list of tasks that are outstanding, with their progress"""
+        try:
+            cls.sync_completed()
+            tasks = TaskModel.retrieve_tasks(TaskModel.query.filter_by(complete=False))
             if not tasks:
                 return None
 
-            return TaskModel.retrieve_tasks(tasks)
+            progress = cls.get_progresses([task['id'] for task in tasks])
+            for task in tasks:
+                task['progress'] = progress.get(str(task['id']), 100)
+            return tasks
         except BaseException as err:
             system_logging(err)
             return None
 
-    @staticmethod
-    def get_task_in_progress(name):
+    @classmethod
+    def get_task_in_progress(cls, name):
         """
         Return a specific outstanding task.
         Prevent user from starting two or more tasks of the same type concurrently,
         Therefore, check if a previous task is currently running before launching a task
         """
         try:
+            cls.sync_completed()
             task = TaskModel.query.filter_by(name=name, complete=False).first()
             if not task:
                 return None
@@ -118,7 +157,7 @@ class TasksController:
     @classmethod
     def cancel_task(cls, job):
         """
-        Given a job, check if it is in task queue and cancel it if true
+        Given a job, check if it is in a task queue and cancel it if true
         :param job: RQ Job or Job ID
         :return: None
         """
@@ -127,9 +166,11 @@ class TasksController:
             task = TaskModel.query.filter(TaskModel.id == job).first()
             if not task:
                 return 'No such task'
-            task_queue = APP.task_queue
-            if task.id in task_queue.job_ids:
-                cls.get_rq_job(task.id).cancel()
+            rq_job = cls.get_rq_job(str(task.id))
+            # Only the job's own hash is read, rather than the list of all the IDs in the queue
+            if rq_job is not None and rq_job.origin in {queue.name for queue in APP.queues.values()} \
+                    and rq_job.get_status(refresh=False) == rq.job.JobStatus.QUEUED:
+                rq_job.cancel()
                 task.complete = True
                 return task.save()
             return None
@@ -162,11 +203,89 @@ class TasksController:
                 so in that situation, 0 is returned as progress
         :return: Progress percentage for the task
         """
-        job = cls.get_rq_job(task.id if task else None)
-        return job.meta.get('progress', 0) if job is not None else 100
+        if not task:
+            return 100
+        return cls.get_progresses([task.id]).get(str(task.id), 100)
 
     @staticmethod
-    def schedule_task(name, description, start, interval, repeat=None, meta=None, *args, **kwarg):
+    def get_queue_metrics() -> dict or None:
+        """
+        Metrics of the queue of every priority class:
+        depth (jobs waiting), age of the oldest waiting job, and the number of jobs started and dropped
+        with the average and latest time they waited, in seconds, as recorded by the workers
+        :return: Dictionary of priority class to metrics, or None in case of error
+        """
+        try:
+            from rq.utils import utcparse
+
+            pipe = APP.redis.pipeline(transaction=False)
+            for queue in APP.queues.values():
+                pipe.llen(queue.key)
+                pipe.lindex(queue.key, 0)
+            pipe.hgetall(TaskUtil.metrics_key())
+            *heads, recorded = pipe.execute()
+            depths, oldest = heads[0::2], heads[1::2]
+
+            # Enqueue times of the oldest jobs, in a second round trip
+            pipe = APP.redis.pipeline(transaction=False)
+            for job_id in filter(None, oldest):
+                pipe.hget(rq.job.Job.key_for(job_id.decode()), 'enqueued_at')
+            found = iter(pipe.execute())
+            enqueued = [next(found) if job_id else None for job_id in oldest]
+
+            recorded = {field.decode(): float(value) for field, value in (recorded or {}).items()}
+            now = datetime.utcnow()
+            metrics = {}
+            for (priority, queue), depth, enqueued_at in zip(APP.queues.items(), depths, enqueued):
+                started = recorded.get(f'{queue.name}:started', 0)
+                metrics[priority] = {
+                    'queue': queue.name,
+                    'depth': depth,
+                    'oldest_wait': (now - utcparse(enqueued_at.decode())).total_seconds() if enqueued_at else 0.0,
+                    'started': int(started),
+                    'dropped': int(recorded.get(f'{queue.name}:dropped', 0)),
+                    'average_wait': recorded.get(f'{queue.name}:waited', 0.0) / started if started else 0.0,
+                    'last_wait': recorded.get(f'{queue.name}:last_wait', 0.0),
+                }
+            return metrics
+        except BaseException as err:
+            system_logging(err)
+            return None
+
+    @staticmethod
+    def get_progresses(task_ids: list) -> dict:
+        """
+        Progress of many tasks, with the same assumptions as get_progress(),
+        fetching all their jobs from Redis in a single pipelined round trip
+        :return: Dictionary of task ID, as a string, to progress percentage. Empty in case of error
+        """
+        task_ids = [str(task_id) for task_id in task_ids or [] if task_id]
+        if not task_ids:
+            return {}
+        try:
+            jobs = rq.job.Job.fetch_many(task_ids, connection=APP.redis)
+        except BaseException as err:
+            system_logging(err)
+            return {}
+        return {
+            task_id: job.meta.get('progress', 0) if job is not None else 100 for task_id, job in zip(task_ids, jobs)
+        }
+
+    @staticmethod
+    def scheduled_job_id(key: str) -> str:
+        """ID of the scheduler job of a unique task, the same in every process"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{APP.config["REDIS_ROOT"]}/scheduled_tasks/{key}'))
+
+    @staticmethod
+    def schedule_lock(**kwargs):
+        """
+        Lock of the scheduler, held by schedule_task and reconcile_scheduled_tasks alike,
+        so that reconciling never sees a job scheduled but not yet saved, nor cancels it
+        """
+        return APP.redis.lock(f'{APP.config["REDIS_ROOT"]}_schedule', timeout=60, **kwargs)
+
+    @classmethod
+    def schedule_task(cls, name, description, start, interval, repeat=None, meta=None, *args, key=None, **kwarg):
         """
         Schedule task using RQ Scheduler and add it to the database
         :param name: Name of task/function to be queued as defined in app/tasks.py
@@ -176,9 +295,12 @@ class TasksController:
         :param repeat: Repeat this number of times (None means repeat forever)
         :param meta: Arbitrary pickle-able data on the job itself
         :param args: Positional arguments to be passed to the task when executed
+        :param key: Unique key of the task. However many processes schedule a task of the same key,
+        a single job is scheduled, and scheduling it again while it is outstanding changes nothing
         :param kwarg: Keyword arguments that will be passed to the task when executed
         :return: The task itself
         """
+        lock = None
         try:
             if not name or type(name) != str:
                 system_logging("Task function provided", exception=True)
@@ -192,7 +314,19 @@ class TasksController:
             repeat = repeat if repeat is None or type(repeat) == int else 10
             meta = meta if meta and type(meta) == dict else {}
 
-            # Submit the job and add it to the queue
+            # Processes scheduling the same task wait for each other, so that only the first one schedules it
+            lock = cls.schedule_lock(blocking_timeout=10)
+            if not lock.acquire():
+                lock = None
+                system_logging(f"Unable to lock scheduler to schedule task {key or name}", exception=True)
+                return None
+            job_id = cls.scheduled_job_id(key) if key else None
+            if job_id and job_id in APP.scheduler:
+                scheduled_task = ScheduledTaskModel.query.filter(ScheduledTaskModel.id == job_id).first()
+                if scheduled_task and not scheduled_task.cancelled:
+                    return scheduled_task
+
+            # Submit the job and add it to the queue. A job of the same ID, if any, is replaced
             rq_job = APP.scheduler.schedule(
                 scheduled_time=start,
                 func=task_config[name],
@@ -201,6 +335,8 @@ class TasksController:
                 interval=interval,
                 repeat=repeat,
                 meta=meta,
+                id=job_id,
+                queue_name=APP.queues[task_priority.get(name, 'default')].name,
                 on_success=report_success,
                 on_failure=report_failure,
             )
@@ -208,9 +344,15 @@ class TasksController:
                 system_logging("Job has not been scheduled", exception=True)
                 return None
             # Create a corresponding Task object in database based on RQ-assigned task ID
-            scheduled_task = ScheduledTaskModel(
-                id=rq_job.get_id(), name=name, start=start, interval=interval, description=description
-            )
+            scheduled_task = ScheduledTaskModel.query.filter(ScheduledTaskModel.id == rq_job.get_id()).first() \
+                if job_id else None
+            if scheduled_task:
+                scheduled_task.start, scheduled_task.interval, scheduled_task.cancelled = start, interval, False
+                scheduled_task.description = description
+            else:
+                scheduled_task = ScheduledTaskModel(
+                    id=rq_job.get_id(), name=name, start=start, interval=interval, description=description
+                )
             # Add the new task object to the session, but it does not issue a commit
             status = scheduled_task.save()
             if status:
@@ -219,16 +361,64 @@ class TasksController:
         except BaseException as err:
             system_logging(err)
             return None
+        finally:
+            if lock:
+                lock.release()
+
+    @classmethod
+    def reconcile_scheduled_tasks(cls):
+        """
+        Bring the scheduler and the scheduled_tasks table into agreement, at boot.
+        Outstanding tasks whose job is no longer in the scheduler are marked cancelled.
+        Jobs of this application's queues in the scheduler that are not outstanding tasks are cancelled,
+        as are duplicates i.e. all tasks of the same name but one, keeping the task keyed by its name if any
+        Only one process reconciles at a time; others skip it
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        lock = cls.schedule_lock()
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            from ..models import unit_of_work
+
+            queues = {queue.name for queue in APP.queues.values()} | {APP.scheduler.queue_name}
+            jobs = {job.get_id(): job for job in APP.scheduler.get_jobs() if job.origin in queues}
+            keep = {}
+            with unit_of_work() as work:
+                tasks = ScheduledTaskModel.query.filter_by(cancelled=False).order_by(ScheduledTaskModel.start.desc())
+                for task in tasks.all():
+                    job = jobs.get(str(task.id))
+                    if job is None:
+                        task.cancelled = True
+                        continue
+                    # A task scheduled with its name as key is kept over the others, otherwise the latest one
+                    keyed = str(task.id) == cls.scheduled_job_id(task.name)
+                    kept = keep.get(task.name)
+                    if kept is None or keyed:
+                        if kept is not None:
+                            kept.cancelled = True
+                        keep[task.name] = task
+                    else:
+                        task.cancelled = True
+            if work.status:
+                return 1
+            kept = {str(task.id) for task in keep.values()}
+            for job_id, job in jobs.items():
+                if job_id not in kept:
+                    APP.scheduler.cancel(job)
+            return 0
+        except BaseException as err:
+            system_logging(err, exception=True)
+            return 1
+        finally:
+            lock.release()
 
     @staticmethod
     def get_scheduled_tasks_in_progress():
         """Return the complete list of scheduled tasks that are outstanding"""
         try:
-            scheduled_tasks = ScheduledTaskModel.query.filter_by(cancelled=False).all()
-            if not scheduled_tasks:
-                return None
-
-            return ScheduledTaskModel.retrieve_scheduled_tasks(scheduled_tasks)
+            scheduled_tasks = ScheduledTaskModel.query.filter_by(cancelled=False)
+            return ScheduledTaskModel.retrieve_scheduled_tasks(scheduled_tasks) or None
         except BaseException as err:
             system_logging(err)
             return None
@@ -5,12 +5,20 @@ This package shall contain the various classes to be mapped to SQL tables and th
 """
 
 import sys
+import json
 import uuid
+import operator
+import threading
+import functools
+from contextlib import contextmanager
 
 import pytz
 
 from app import db, app
 
+# Format of the timestamps sent to clients e.g. Monday Jan 17, 2022 09:30 AM
+DATE_FORMAT = "%A %b %d, %Y %I:%M %p"
+
 
 def time_now():
     """
@@ -21,16 +29,284 @@ def time_now():
     return datetime.datetime.now(tz=pytz.timezone('Africa/Nairobi'))
 
 
+class UnitOfWork:
+    """
+    Groups the saves and deletes made within it into a single transaction, committed once on exit.
+    Units of work can be nested, in which case only the outermost one commits
+    Use through unit_of_work()
+    """
+
+    def __init__(self):
+        # Status code of the commit. 0 -> Success, 1 -> Failure
+        self.status = 0
+
+    @staticmethod
+    def active() -> bool:
+        return db.session.info.get('unit_of_work', 0) > 0
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Write everything saved within the block in one transaction e.g. a whole conversational turn
+    If the block raises, the transaction is rolled back and the exception propagates.
+    If the commit fails, the transaction is rolled back and the status of the unit of work set to 1
+    :return: The UnitOfWork, whose status can be checked after the block
+    """
+    work = UnitOfWork()
+    depth = db.session.info.get('unit_of_work', 0)
+    db.session.info['unit_of_work'] = depth + 1
+    try:
+        yield work
+    except BaseException:
+        db.session.info['unit_of_work'] = depth
+        if not depth:
+            db.session.rollback()
+        raise
+    db.session.info['unit_of_work'] = depth
+    if not depth:
+        try:
+            db.session.commit()
+        except Exception as err:
+            app.logger.exception(f'Error committing unit of work\nException: {err}', exc_info=sys.exc_info())
+            db.session.rollback()
+            work.status = 1
+
+
+class WriteBehindBuffer:
+    """
+    Buffers rows of append-only tables (e.g. messages, logs) and writes them from a background thread,
+    in bulk and in a single transaction per model and flush, so that concurrent writers share commits.
+    The buffer is flushed an interval after the first row is buffered, or as soon as it holds batch_size rows.
+    It is bounded: once full, rows are refused and counted as dropped, leaving the caller to decide what to do
+    """
+
+    def __init__(self, interval=0.005, max_size=10000, batch_size=None, max_delay=5.0):
+        """
+        :param interval: Seconds rows wait for others to join them before being flushed
+        :param max_size: Maximum number of rows held, beyond which rows are refused
+        :param batch_size: Number of rows that triggers a flush before the interval elapses
+        :param max_delay: Maximum seconds between retries while the database is unavailable
+        """
+        self.interval = interval
+        self.max_size = max_size
+        self.batch_size = batch_size or max_size
+        self.max_delay = max_delay
+        # Model -> list of rows
+        self.rows = {}
+        self.size = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        # Set while rows are buffered, and once batch_size rows are
+        self.pending = threading.Event()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def add(self, model, values: dict):
+        """
+        Buffer a row of the model for writing
+        :param model: Model of the row
+        :param values: Dictionary of the row's attributes
+        :return: Status code. 0 -> Buffered, 1 -> Buffer is full
+        """
+        with self.lock:
+            if self.size >= self.max_size:
+                self.dropped += 1
+                return 1
+            self.rows.setdefault(model, []).append(values)
+            self.size += 1
+            self.pending.set()
+            if self.size >= self.batch_size:
+                self.wake.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+                self.thread.start()
+        return 0
+
+    def run(self):
+        import time
+        delay = self.interval
+        # A single application context serves every flush
+        with app.app_context():
+            while True:
+                # Sleep until rows are buffered, then leave others the interval to join them
+                self.pending.wait()
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                if not self.flush():
+                    delay = self.interval
+                    continue
+                # The database is unavailable and the rows were put back: wait longer before each new try
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+
+    def flush(self):
+        """
+        Write the buffered rows
+        :return: Status code. 0 -> Success, 1 -> Database unavailable, rows put back in the buffer
+        """
+        with self.lock:
+            rows, self.rows, self.size = self.rows, {}, 0
+            self.pending.clear()
+        left = {}
+        for model, values in rows.items():
+            # Once the database is found unavailable, the rows of the other models are not tried either
+            unwritten = values if left else self.write(model, values)
+            if unwritten:
+                left[model] = unwritten
+        if left:
+            self.requeue(left)
+            return 1
+        return 0
+
+    def write(self, model, rows: list) -> list:
+        """
+        Insert the rows of the model, halving a batch that fails until the rows at fault are found.
+        Rows rejected on their own e.g. for violating a constraint are logged and counted as failed
+        :return: Rows left unwritten as the database is unavailable, to be tried again
+        """
+        from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError
+        try:
+            db.session.bulk_insert_mappings(model, rows)
+            db.session.commit()
+            return []
+        except Exception as err:
+            db.session.rollback()
+            if isinstance(err, DBAPIError) and (
+                    err.connection_invalidated or isinstance(err, (OperationalError, InterfaceError))):
+                app.logger.exception(f'Error writing buffered rows\nException: {err}', exc_info=sys.exc_info())
+                return rows
+            if len(rows) == 1:
+                self.failed += 1
+                app.logger.exception(f'Error writing buffered row {rows[0]}\nException: {err}', exc_info=sys.exc_info())
+                return []
+        middle = len(rows) // 2
+        unwritten = self.write(model, rows[:middle])
+        if unwritten:
+            return unwritten + rows[middle:]
+        return self.write(model, rows[middle:])
+
+    def requeue(self, rows: dict):
+        """Put rows that could not be written back at the front of the buffer, dropping those beyond its size"""
+        with self.lock:
+            for model, values in rows.items():
+                room = max(self.max_size - self.size, 0)
+                if len(values) > room:
+                    self.dropped += len(values) - room
+                    values = values[:room]
+                self.rows[model] = values + self.rows.get(model, [])
+                self.size += len(values)
+            if self.size:
+                self.pending.set()
+
+
+@functools.lru_cache(maxsize=8192)
+def format_minute(minute) -> str:
+    return minute.strftime(DATE_FORMAT)
+
+
+def format_timestamp(timestamp) -> str or None:
+    """
+    Format a timestamp in DATE_FORMAT
+    The format stops at minutes, so timestamps of the same minute share a single (cached) formatting
+    """
+    if timestamp is None:
+        return None
+    return format_minute(timestamp.replace(second=0, microsecond=0))
+
+
+class Serializer:
+    """
+    Converts the rows of a model into dictionaries ready to be sent as JSON.
+    Queries select only the serialized columns, as tuples, sparing the construction of model instances
+    """
+
+    def __init__(self, model, fields: dict, timestamps=(), positions: bool = False):
+        """
+        :param model: Model of the rows
+        :param fields: Key in the output -> name of the model's attribute
+        :param timestamps: Keys whose values are datetimes, formatted in DATE_FORMAT
+        :param positions: Whether to number the rows, from 1, under the key position
+        """
+        self.model = model
+        self.keys = tuple(fields)
+        self.attributes = tuple(fields.values())
+        self.timestamps = tuple(index for index, key in enumerate(self.keys) if key in timestamps)
+        self.positions = positions
+        getter = operator.attrgetter(*self.attributes)
+        # attrgetter returns a bare value rather than a tuple when given a single attribute
+        self.getter = getter if len(self.attributes) > 1 else lambda record: (getter(record),)
+
+    @property
+    def columns(self) -> list:
+        return [getattr(self.model, attribute) for attribute in self.attributes]
+
+    def rows(self, rows) -> list:
+        """Serialize tuples of the attributes' values, in the order of the fields"""
+        keys, timestamps = self.keys, self.timestamps
+        results = []
+        for row in rows:
+            if timestamps:
+                row = list(row)
+                for index in timestamps:
+                    row[index] = format_timestamp(row[index])
+            results.append(dict(zip(keys, row)))
+        if self.positions:
+            for position, result in enumerate(results, 1):
+                result['position'] = position
+        return results
+
+    def serialize(self, records) -> list:
+        """
+        Serialize the records
+        :param records: Query of the model, run selecting only the serialized columns,
+        or list of instances of the model, anything else in the list being skipped
+        """
+        from sqlalchemy.orm import Query
+
+        if isinstance(records, Query):
+            return self.rows(records.with_entities(*self.columns))
+        if not records or not isinstance(records, list):
+            return []
+        model, getter = self.model, self.getter
+        return self.rows(getter(record) for record in records if type(record) is model)
+
+    @staticmethod
+    def dumps(value, *args, **kwargs) -> str:
+        """
+        Encode serialized rows as JSON, with orjson when available
+        Accepts, and ignores, the arguments of json.dumps, so that the class can stand in for the json module
+        e.g. as Socket.IO's encoder of the payloads it emits. orjson's output is always compact
+        """
+        try:
+            import orjson
+        except ImportError:
+            return json.dumps(value, *args, **dict(kwargs, default=str))
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    @staticmethod
+    def loads(value, *args, **kwargs):
+        try:
+            import orjson
+        except ImportError:
+            return json.loads(value, *args, **kwargs)
+        return orjson.loads(value)
+
+
 def save(field: db.Model):
     """
     Method to save a field into the database
     If successful, the field is committed and success status code returned
     If unsuccessful, the field is rolled back and failure status code returned
+    Within a unit of work, the field is only added to the transaction, which the unit of work commits
     :param field: The record to be saved
     :return: Status code. 0 -> Success, 1 -> Failure
     """
     try:
         db.session.add(field)
+        if UnitOfWork.active():
+            return 0
         db.session.commit()
         return 0
     except Exception as err:
@@ -49,6 +325,8 @@ def delete(field):
     """
     try:
         db.session.delete(field)
+        if UnitOfWork.active():
+            return 0
         db.session.commit()
         return 0
     except Exception as err:
@@ -116,6 +394,8 @@ from .conversations import ConversationModel, MessageModel
 
 app_models = {
     'db': db,
+    'unit_of_work': unit_of_work,
+    Serializer.__name__: Serializer,
     TaskModel.__name__: TaskModel,
     ScheduledTaskModel.__name__: ScheduledTaskModel,
     LogModel.__name__: LogModel,
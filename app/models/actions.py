@@ -1,8 +1,10 @@
 # app/models/tags.py
 
-from app import db
+import sys
 
-from . import save, delete, time_now, GUID
+from app import db, app
+
+from . import save, delete, time_now, GUID, UnitOfWork, Serializer
 
 
 class ActionModel(db.Model):
@@ -13,6 +15,10 @@ class ActionModel(db.Model):
     """
 
     __tablename__ = 'actions'
+    __table_args__ = (
+        # Backs the lookup of a conversation's pending action
+        db.Index('ix_actions_conversation_id_completed', 'conversation_id', 'completed'),
+    )
 
     id = db.Column(GUID, primary_key=True)
     name = db.Column(db.Text, nullable=False)
@@ -22,20 +28,31 @@ class ActionModel(db.Model):
 
     @staticmethod
     def retrieve_actions(actions: list):
-        if not actions or type(actions) != list:
-            return []
-        _actions = []
-        for position, action in enumerate(actions):
-            if not action or not isinstance(action, ActionModel):
-                continue
-            _actions.append({
-                'position': position + 1,
-                'id': action.id,
-                'name': action.name,
-                'completed': action.completed,
-                'conversation_id': action.conversation_id,
-                'timestamp': action.timestamp.strftime("%A %b %d, %Y %I:%M %p"),
-            })
+        return ACTION_SERIALIZER.serialize(actions)
+
+    @staticmethod
+    def pending(conversation_id: str):
+        """Retrieve the action that the conversation is waiting on, if any"""
+        return ActionModel.query.filter_by(conversation_id=conversation_id, completed=False).first()
+
+    @staticmethod
+    def complete(action_id):
+        """
+        Mark the action completed without loading it first
+        Within a unit of work, the update is committed with the rest of the unit
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        try:
+            ActionModel.query.filter(ActionModel.id == action_id).update(
+                {'completed': True}, synchronize_session=False,
+            )
+            if not UnitOfWork.active():
+                db.session.commit()
+            return 0
+        except Exception as err:
+            app.logger.exception(f'Error completing action {action_id}\nException: {err}', exc_info=sys.exc_info())
+            db.session.rollback()
+            return 1
 
     def save(self):
         return save(self)
@@ -45,3 +62,11 @@ class ActionModel(db.Model):
 
     def __repr__(self):
         return f'Action: {self.id}'
+
+
+ACTION_SERIALIZER = Serializer(
+    ActionModel, dict(
+        id='id', name='name', completed='completed', conversation_id='conversation_id', timestamp='timestamp',
+    ),
+    timestamps=('timestamp',), positions=True,
+)
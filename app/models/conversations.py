@@ -1,8 +1,10 @@
 # app/models/conversations.py
 
-from app import db
+import sys
 
-from . import save, delete, time_now
+from app import db, app
+
+from . import save, delete, time_now, UnitOfWork, Serializer
 
 
 class ConversationModel(db.Model):
@@ -12,10 +14,22 @@ class ConversationModel(db.Model):
     """
 
     __tablename__ = 'conversations'
+    __table_args__ = (
+        # Only conversations awaiting a reply are indexed, keeping the index as small as the backlog
+        db.Index(
+            'ix_conversations_awaiting_reply', 'last_message_at',
+            postgresql_where=db.text("last_message_sender = 'client'"),
+            sqlite_where=db.text("last_message_sender = 'client'"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     conversation_id = db.Column(db.String(50), nullable=False, unique=True)
     creation_date = db.Column(db.DateTime, default=time_now(), )
+    # Sender and time of the latest message, kept up to date on every message saved
+    # so that conversations awaiting a reply are found without reading their messages
+    last_message_sender = db.Column(db.Text)
+    last_message_at = db.Column(db.DateTime)
     # Relationship between conversations and messages
     messages = db.relationship(
         'MessageModel',
@@ -25,19 +39,54 @@ class ConversationModel(db.Model):
 
     @staticmethod
     def retrieve_conversations(conversations):
-        if not conversations or not isinstance(conversations, list):
+        conversations = CONVERSATION_SERIALIZER.serialize(conversations)
+        if not conversations:
             return []
-        _conversations = []
+        # The messages of all conversations are fetched in a single query
+        messages = {conversation['id']: [] for conversation in conversations}
+        query = MessageModel.query.filter(MessageModel.conversation_id.in_(list(messages)))
+        for message in MessageModel.retrieve_messages(query.order_by(MessageModel.timestamp, MessageModel.id)):
+            messages[message['conversation_id']].append(message)
         for conversation in conversations:
-            if not conversation or not isinstance(conversation, ConversationModel):
-                continue
-            messages = MessageModel.query.filter(MessageModel.conversation_id == conversation.conversation_id).all()
-            _conversations.append({
-                'id': conversation.conversation_id,
-                'messages': MessageModel.retrieve_messages(messages),
-                'creation_date': conversation.creation_date.strftime("%A %b %d, %Y %I:%M %p"),
-            })
-        return _conversations
+            conversation['messages'] = messages[conversation['id']]
+        return conversations
+
+    @staticmethod
+    def touch(conversation_id: str, sender: str, timestamp):
+        """
+        Record the sender and time of the latest message of the conversation
+        Within a unit of work, the update is committed with the rest of the unit
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        try:
+            ConversationModel.query.filter(ConversationModel.conversation_id == conversation_id).update(
+                {'last_message_sender': sender, 'last_message_at': timestamp}, synchronize_session=False,
+            )
+            if not UnitOfWork.active():
+                db.session.commit()
+            return 0
+        except Exception as err:
+            app.logger.exception(
+                f'Error updating conversation {conversation_id}\nException: {err}', exc_info=sys.exc_info(),
+            )
+            db.session.rollback()
+            return 1
+
+    @staticmethod
+    def awaiting_reply(limit: int = None, older_than: float = 0) -> list:
+        """
+        Retrieve the conversations whose latest message is from the client, oldest first
+        Backed by the partial index ix_conversations_awaiting_reply
+        :param older_than: Seconds since the latest message, below which a conversation is left out
+        """
+        import datetime
+        query = ConversationModel.query.filter(ConversationModel.last_message_sender == 'client')
+        if older_than:
+            query = query.filter(
+                ConversationModel.last_message_at <= time_now() - datetime.timedelta(seconds=older_than),
+            )
+        query = query.order_by(ConversationModel.last_message_at)
+        return query.limit(limit).all() if limit else query.all()
 
     def save(self):
         return save(self)
@@ -56,6 +105,10 @@ class MessageModel(db.Model):
     """
 
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Backs the keyset pagination of a conversation's history
+        db.Index('ix_messages_conversation_id_timestamp', 'conversation_id', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     conversation_id = db.Column(
@@ -68,21 +121,46 @@ class MessageModel(db.Model):
 
     @staticmethod
     def retrieve_messages(messages):
-        if not messages or not isinstance(messages, list):
-            return []
-        _messages = []
+        return MessageModel.flag_client(MESSAGE_SERIALIZER.serialize(messages))
+
+    @staticmethod
+    def flag_client(messages: list) -> list:
+        """Mark the serialized messages sent by the client"""
         for message in messages:
-            if not message or not isinstance(message, MessageModel):
-                continue
-            _messages.append({
-                'id': message.id,
-                'timestamp': message.timestamp.strftime("%A %b %d, %Y %I:%M %p"),
-                'sender': message.sender,
-                'is_client': message.sender == 'client',
-                'conversation_id': message.conversation_id,
-                'message': message.body,
-            })
-        return _messages
+            message['is_client'] = message['sender'] == 'client'
+        return messages
+
+    @staticmethod
+    def retrieve_page(conversation_id: str, limit: int = 50, cursor: str = None):
+        """
+        Retrieve a page of a conversation's history, using (timestamp, id) keyset pagination
+        so that the cost of a page does not depend on the length of the conversation
+        :param conversation_id: ID of the conversation
+        :param limit: Maximum number of messages in the page
+        :param cursor: Cursor returned with the previous (newer) page. If not given, the latest messages are returned
+        :return: Tuple of the serialized messages, oldest first, and the cursor of the next (older) page or None
+        """
+        if not conversation_id or not isinstance(conversation_id, str):
+            return [], None
+        query = MessageModel.query.filter(MessageModel.conversation_id == conversation_id)
+        if cursor and isinstance(cursor, str):
+            import datetime
+            try:
+                timestamp, _id = cursor.rsplit('|', 1)
+                timestamp, _id = datetime.datetime.fromisoformat(timestamp), int(_id)
+            except ValueError:
+                return [], None
+            query = query.filter(db.or_(
+                MessageModel.timestamp < timestamp,
+                db.and_(MessageModel.timestamp == timestamp, MessageModel.id < _id),
+            ))
+        # Fetch an extra message to find out whether there is an older page
+        rows = query.order_by(MessageModel.timestamp.desc(), MessageModel.id.desc()).limit(limit + 1).with_entities(
+            MessageModel.timestamp, MessageModel.id, *MESSAGE_SERIALIZER.columns,
+        ).all()
+        older = rows[limit - 1] if len(rows) > limit else None
+        messages = MessageModel.flag_client(MESSAGE_SERIALIZER.rows(row[2:] for row in rows[:limit][::-1]))
+        return messages, f'{older[0].isoformat()}|{older[1]}' if older else None
 
     def save(self):
         return save(self)
@@ -92,3 +170,14 @@ class MessageModel(db.Model):
 
     def __repr__(self):
         return '<Message {}>'.format(self.body)
+
+
+CONVERSATION_SERIALIZER = Serializer(
+    ConversationModel, dict(id='conversation_id', creation_date='creation_date'), timestamps=('creation_date',),
+)
+MESSAGE_SERIALIZER = Serializer(
+    MessageModel, dict(
+        id='id', timestamp='timestamp', sender='sender', conversation_id='conversation_id', message='body',
+    ),
+    timestamps=('timestamp',),
+)
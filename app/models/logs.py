@@ -2,11 +2,11 @@
 
 import uuid
 
-from flask import request
+from flask import request, has_request_context
 
 from app import db
 
-from . import save, time_now, delete, GUID
+from . import save, time_now, delete, GUID, Serializer
 
 
 class LogModel(db.Model):
@@ -28,32 +28,19 @@ class LogModel(db.Model):
 
     @staticmethod
     def retrieve_logs(logs: list):
-        if not logs or type(logs) != list:
+        logs = LOG_SERIALIZER.serialize(logs)
+        if not logs:
             return []
-        _logs = []
         from ..utils import Helper
-        base_url = Helper.parse_url(request.url)
-        for position, log in enumerate(logs):
-            if not log or type(log) != LogModel:
-                continue
-            if Helper.detect_url(log.log_file):
-                log_file = log.log_file
-            else:
-                log_file = f'{base_url}{log.log_file}'
-            _logs.append(
-                {
-                    "id": log.id,
-                    "log_file": log_file,
-                    "message": log.message,
-                    "level": log.level,
-                    "source": log.source,
-                    "platform": log.platform,
-                    "position": position + 1,
-                    "timestamp": log.timestamp.strftime("%A %b %d, %Y %I:%M %p"),
-                    "created_on": log.created_on.strftime("%A %b %d, %Y %I:%M %p"),
-                }
-            )
-        return _logs
+        base_url = Helper.parse_url(request.url) if has_request_context() else ''
+        # Logs share a handful of files, so every file is only checked once
+        log_files = {}
+        for log in logs:
+            log_file = log['log_file']
+            if log_file not in log_files:
+                log_files[log_file] = log_file if Helper.detect_url(log_file) else f'{base_url}{log_file}'
+            log['log_file'] = log_files[log_file]
+        return logs
 
     def save(self):
         return save(self)
@@ -63,3 +50,12 @@ class LogModel(db.Model):
 
     def __repr__(self):
         return '<Logged message: {}>'.format(self.message)
+
+
+LOG_SERIALIZER = Serializer(
+    LogModel, dict(
+        id='id', log_file='log_file', message='message', level='level', source='source', platform='platform',
+        timestamp='timestamp', created_on='created_on',
+    ),
+    timestamps=('timestamp', 'created_on'), positions=True,
+)
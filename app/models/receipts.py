@@ -2,7 +2,7 @@
 
 from app import db
 
-from . import save, delete, GUID
+from . import save, delete, GUID, Serializer
 
 
 class ReceiptModel(db.Model):
@@ -11,6 +11,10 @@ class ReceiptModel(db.Model):
     Keep track of value transfer data to an InfinitePay customer's bank account arising from transactions
     """
     __tablename__ = 'receipts'
+    __table_args__ = (
+        # Supports looking up and reconciling a merchant's receipts by date. It is also the receipts' natural key
+        db.Index('ix_receipts_merchant_id_created_at', 'merchant_id', 'created_at', unique=True),
+    )
 
     id = db.Column(GUID, primary_key=True)
     merchant_id = db.Column(db.Integer)
@@ -21,20 +25,7 @@ class ReceiptModel(db.Model):
 
     @staticmethod
     def retrieve_receipts(receipts: list):
-        if not receipts or type(receipts) != list:
-            return []
-        _receipts = []
-        for position, receipt in enumerate(receipts):
-            if not receipt or type(receipt) != ReceiptModel:
-                continue
-            _receipts.append({
-                'merchant_id': receipt.merchant_id,
-                'created_at': receipt.created_at,
-                'status': receipt.status,
-                'description': receipt.description,
-                'value': receipt.value,
-            })
-        return _receipts
+        return RECEIPT_SERIALIZER.serialize(receipts)
 
     def save(self):
         return save(self)
@@ -44,3 +35,11 @@ class ReceiptModel(db.Model):
 
     def __repr__(self):
         return f"Receipt: {self.id}"
+
+
+RECEIPT_SERIALIZER = Serializer(
+    ReceiptModel, dict(
+        merchant_id='merchant_id', created_at='created_at', status='status', description='description',
+        value='value',
+    ),
+)
@@ -2,7 +2,7 @@
 
 from app import db
 
-from . import save, delete, GUID
+from . import save, delete, GUID, Serializer
 
 
 class SaleModel(db.Model):
@@ -12,34 +12,22 @@ class SaleModel(db.Model):
     """
 
     __tablename__ = 'sales'
+    __table_args__ = (
+        # Supports looking up and reconciling a merchant's sales by date
+        db.Index('ix_sales_merchant_id_created_at', 'merchant_id', 'created_at'),
+    )
 
     id = db.Column(GUID, primary_key=True)
-    id_sale = db.Column(db.Integer)
+    id_sale = db.Column(db.Integer, index=True, unique=True)
     merchant_id = db.Column(db.Integer)
-    chip_id = db.Column(db.Integer)
+    chip_id = db.Column(db.Text)
     created_at = db.Column(db.Text)
     status = db.Column(db.Text)
     description = db.Column(db.Text)
 
     @staticmethod
     def retrieve_sales(sales: list):
-        if not sales or type(sales) != list:
-            return []
-        _sales = []
-
-        for position, sale in enumerate(sales):
-            if not sale or type(sale) != SaleModel:
-                continue
-            _sales.append({
-                'id_sale': sale.id_sale,
-                'merchant_id': sale.merchant_id,
-                'chip_id': sale.chip_id,
-                'created_at': sale.created_at,
-                'status': sale.status,
-                'description': sale.description,
-            })
-
-        return _sales
+        return SALE_SERIALIZER.serialize(sales)
 
     def save(self):
         return save(self)
@@ -49,3 +37,11 @@ class SaleModel(db.Model):
 
     def __repr__(self):
         return f"Sale: {self.id}"
+
+
+SALE_SERIALIZER = Serializer(
+    SaleModel, dict(
+        id_sale='id_sale', merchant_id='merchant_id', chip_id='chip_id', created_at='created_at', status='status',
+        description='description',
+    ),
+)
@@ -2,7 +2,7 @@
 
 from app import db
 
-from . import save, time_now, delete, GUID
+from . import save, time_now, delete, GUID, Serializer
 
 
 class ScheduledTaskModel(db.Model):
@@ -22,24 +22,7 @@ class ScheduledTaskModel(db.Model):
 
     @staticmethod
     def retrieve_scheduled_tasks(scheduled_tasks: list):
-        if not scheduled_tasks or type(scheduled_tasks) != list:
-            return []
-        _scheduled_tasks = []
-        for position, scheduled_task in enumerate(scheduled_tasks):
-            if not scheduled_task or type(scheduled_task) != ScheduledTaskModel:
-                continue
-            _scheduled_tasks.append(
-                {
-                    'position': position + 1,
-                    'id': scheduled_task.id,
-                    'name': scheduled_task.name,
-                    'description': scheduled_task.description,
-                    'cancelled': scheduled_task.cancelled,
-                    'beginning': scheduled_task.start.strftime("%A %b %d, %Y %I:%M %p"),
-                    'interval': scheduled_task.interval,
-                }
-            )
-        return _scheduled_tasks
+        return SCHEDULED_TASK_SERIALIZER.serialize(scheduled_tasks)
 
     def save(self):
         return save(self)
@@ -49,3 +32,12 @@ class ScheduledTaskModel(db.Model):
 
     def __repr__(self):
         return '<Scheduled task: {}>'.format(self.id)
+
+
+SCHEDULED_TASK_SERIALIZER = Serializer(
+    ScheduledTaskModel, dict(
+        id='id', name='name', description='description', cancelled='cancelled', beginning='start',
+        interval='interval',
+    ),
+    timestamps=('beginning',), positions=True,
+)
@@ -1,8 +1,10 @@
 # app/models/tasks.py
 
-from app import db
+import sys
 
-from . import save, time_now, delete, GUID
+from app import db, app
+
+from . import save, time_now, delete, GUID, Serializer, UnitOfWork
 
 
 class TaskModel(db.Model):
@@ -22,22 +24,25 @@ class TaskModel(db.Model):
 
     @staticmethod
     def retrieve_tasks(tasks: list):
-        if not tasks or type(tasks) != list:
-            return []
-        _tasks = []
-        for position, task in enumerate(tasks):
-            if not task or type(task) != TaskModel:
-                continue
-            _tasks.append(
-                {
-                    'id': task.id,
-                    'name': task.name,
-                    'timestamp': task.timestamp.strftime("%A %b %d, %Y %I:%M %p"),
-                    'description': task.description,
-                    'complete': task.complete,
-                }
-            )
-        return _tasks
+        return TASK_SERIALIZER.serialize(tasks)
+
+    @staticmethod
+    def mark_complete(task_ids: list):
+        """
+        Mark the tasks complete in a single update
+        :return: Status code. 0 -> Success, 1 -> Failure
+        """
+        if not task_ids:
+            return 0
+        try:
+            TaskModel.query.filter(TaskModel.id.in_(task_ids)).update({'complete': True}, synchronize_session=False)
+            if not UnitOfWork.active():
+                db.session.commit()
+            return 0
+        except Exception as err:
+            app.logger.exception(f'Error completing tasks {task_ids}\nException: {err}', exc_info=sys.exc_info())
+            db.session.rollback()
+            return 1
 
     def save(self):
         return save(self)
@@ -47,3 +52,9 @@ class TaskModel(db.Model):
 
     def __repr__(self):
         return '<Task: {}>'.format(self.id)
+
+
+TASK_SERIALIZER = Serializer(
+    TaskModel, dict(id='id', name='name', timestamp='timestamp', description='description', complete='complete'),
+    timestamps=('timestamp',),
+)
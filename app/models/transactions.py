@@ -2,7 +2,7 @@
 
 from app import db
 
-from . import save, delete, GUID
+from . import save, delete, GUID, Serializer
 
 
 class TransactionModel(db.Model):
@@ -12,30 +12,20 @@ class TransactionModel(db.Model):
     """
 
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Supports looking up and reconciling a merchant's transactions by date
+        db.Index('ix_transactions_merchant_id_created_at', 'merchant_id', 'created_at'),
+    )
 
     id = db.Column(GUID, primary_key=True)
-    transaction_id = db.Column(db.Integer)
+    transaction_id = db.Column(db.Integer, index=True, unique=True)
     merchant_id = db.Column(db.Integer)
     created_at = db.Column(db.Text)
     value = db.Column(db.Float)
 
     @staticmethod
     def retrieve_transactions(transactions: list):
-        if not transactions or type(transactions) != list:
-            return []
-        _transactions = []
-
-        for position, transaction in enumerate(transactions):
-            if not transaction or type(transaction) != TransactionModel:
-                continue
-            _transactions.append({
-                'transaction_id': transaction.transaction_id,
-                'merchant_id': transaction.merchant_id,
-                'created_at': transaction.created_at,
-                'value': transaction.value,
-            })
-
-        return _transactions
+        return TRANSACTION_SERIALIZER.serialize(transactions)
 
     def save(self):
         return save(self)
@@ -45,3 +35,10 @@ class TransactionModel(db.Model):
 
     def __repr__(self):
         return f"Transaction: {self.id}"
+
+
+TRANSACTION_SERIALIZER = Serializer(
+    TransactionModel, dict(
+        transaction_id='transaction_id', merchant_id='merchant_id', created_at='created_at', value='value',
+    ),
+)
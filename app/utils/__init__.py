@@ -7,16 +7,30 @@ This package shall bring together the various utility modules and functions requ
 from .misc import *
 from .tasks import *
 from .errors import *
+from .intents import *
+from .clients import *
+from .cache import *
+from .seed import *
 
 roles = ['admin', 'client', 'provider']
 
 app_utils = {
     TaskUtil.__name__: TaskUtil,
+    AppWorker.__name__: AppWorker,
     Helper.__name__: Helper,
+    IntentMatcher.__name__: IntentMatcher,
+    HttpClient.__name__: HttpClient,
+    UpstreamUnavailable.__name__: UpstreamUnavailable,
+    ResponseCache.__name__: ResponseCache,
+    SeedLoader.__name__: SeedLoader,
     BandwidthExceeded.__name__: BandwidthExceeded,
     BackgroundTaskError.__name__: BackgroundTaskError,
     'set_logger': set_logger,
+    'configure_logging': configure_logging,
+    ErrorAlertHandler.__name__: ErrorAlertHandler,
     'task_config': task_config,
+    'task_priority': task_priority,
+    'priority_queues': priority_queues,
     'system_logging': system_logging,
     'check_failed_rq_jobs': check_failed_rq_jobs,
 }
@@ -0,0 +1,144 @@
+# app/utils/cache.py
+
+"""
+This module contains the cache placed in front of the upstream API lookups.
+Results are kept in an in-process LRU and, optionally, in Redis so that all workers share them.
+Concurrent lookups of the same key are coalesced into a single upstream call
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from .errors import system_logging
+from ..models import Serializer
+
+
+class ResponseCache:
+    """
+    Two tier TTL cache.
+    The first tier is a bounded LRU local to the process, the second an optional Redis instance.
+    Only successful (not None) results are cached
+    """
+
+    def __init__(self, max_size=1024, redis=None, prefix='cache', wait_timeout=30.0):
+        """
+        :param max_size: Maximum number of entries kept in the process
+        :param redis: Optional Redis connection used as a shared tier
+        :param prefix: Prefix of the keys saved in Redis
+        :param wait_timeout: Seconds a coalesced lookup waits for the one in flight before giving up
+        """
+        self.max_size = max_size
+        self.redis = redis
+        self.prefix = prefix
+        self.wait_timeout = wait_timeout
+        # Key -> (expiry time, value)
+        self.entries = OrderedDict()
+        # Key -> lookup in flight
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'redis_hits': 0, 'misses': 0, 'coalesced': 0, 'redis_errors': 0}
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters and current size of the cache"""
+        return dict(self.counters, size=len(self.entries))
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key: str):
+        """Return the cached value of the key, or None if absent or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self.entries[key]
+        if self.redis is None:
+            return None
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(f'{self.prefix}:{key}')
+            pipe.ttl(f'{self.prefix}:{key}')
+            raw, ttl = pipe.execute()
+        except Exception as err:
+            # The lookup goes on without the shared tier
+            system_logging(f'Error reading {key} from the Redis cache\n{err}', exception=True)
+            self.count('redis_errors')
+            return None
+        if raw is None:
+            return None
+        value = Serializer.loads(raw)
+        self.store(key, value, ttl if ttl and ttl > 0 else 1)
+        self.count('redis_hits')
+        return value
+
+    def store(self, key: str, value, ttl):
+        """Save the value in the process' tier, evicting the least recently used entries beyond max size"""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def set(self, key: str, value, ttl):
+        """Save the value in both tiers for ttl seconds"""
+        self.store(key, value, ttl)
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(f'{self.prefix}:{key}', Serializer.dumps(value), ex=int(ttl) or 1)
+        except Exception as err:
+            system_logging(f'Error saving {key} in the Redis cache\n{err}', exception=True)
+            self.count('redis_errors')
+
+    def get_or_fetch(self, key: str, ttl, fetch):
+        """
+        Return the cached value of the key, calling fetch to obtain it on a miss.
+        If the same key is already being fetched, wait for that call instead of making another
+        :param key: Key of the value
+        :param ttl: Seconds the value remains valid. If not set, the cache is bypassed
+        :param fetch: Callable, without arguments, that returns the value
+        :return: The value
+        """
+        if not ttl:
+            return fetch()
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            call = self.pending.get(key)
+            leader = call is None
+            if leader:
+                call = self.pending[key] = {'event': threading.Event(), 'value': None, 'error': None}
+            self.counters['misses' if leader else 'coalesced'] += 1
+
+        if not leader:
+            if not call['event'].wait(self.wait_timeout):
+                return fetch()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value']
+
+        try:
+            value = fetch()
+            call['value'] = value
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        except Exception as err:
+            call['error'] = err
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+            call['event'].set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
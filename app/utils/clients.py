@@ -0,0 +1,132 @@
+# app/utils/clients.py
+
+"""
+This module contains the HTTP client used to reach the upstream APIs (logistics, telecoms etc.)
+Connections are pooled and kept alive per upstream host, every request is bounded by timeouts
+and a circuit breaker stops calling an upstream that keeps failing
+"""
+
+import time
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when an upstream API can not be reached or its circuit is open"""
+    pass
+
+
+class HttpClient:
+    """
+    Shared client for upstream APIs.
+    Each host gets its own session (and thus connection pool),
+    and its own circuit breaker that opens after a number of consecutive failures
+    and lets a single trial request through once the reset timeout has passed
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10.0, retries=2, backoff=0.3, pool_size=10,
+                 failure_threshold=5, reset_timeout=30.0):
+        """
+        :param connect_timeout: Seconds to wait for a connection to the upstream
+        :param read_timeout: Seconds to wait for the upstream to send a response
+        :param retries: Number of retries on connection errors and 5xx/429 responses
+        :param backoff: Backoff factor in seconds between retries
+        :param pool_size: Number of connections kept alive per upstream host
+        :param failure_threshold: Consecutive failures after which the circuit of a host opens
+        :param reset_timeout: Seconds after which an open circuit lets a trial request through
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sessions = {}
+        # Host -> (consecutive failures, time the circuit opened)
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a client from the application's configuration"""
+        return cls(
+            connect_timeout=config.get('HTTP_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('HTTP_READ_TIMEOUT', 10.0),
+            retries=config.get('HTTP_RETRIES', 2),
+            backoff=config.get('HTTP_BACKOFF', 0.3),
+            pool_size=config.get('HTTP_POOL_SIZE', 10),
+            failure_threshold=config.get('HTTP_CIRCUIT_FAILURES', 5),
+            reset_timeout=config.get('HTTP_CIRCUIT_RESET', 30.0),
+        )
+
+    def session(self, host: str, retry: bool = True) -> requests.Session:
+        """
+        Return the session holding the connection pool of the given host
+        :param retry: Whether failed requests are retried. Requests that change data upstream should not be
+        """
+        session = self.sessions.get((host, retry))
+        if session is None:
+            with self.lock:
+                session = self.sessions.get((host, retry))
+                if session is None:
+                    # The upstream lookups only read data, so retrying POST requests is safe
+                    retries = self.retries if retry else 0
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=Retry(
+                        total=retries, connect=retries, read=retries, backoff_factor=self.backoff,
+                        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=False, raise_on_status=False,
+                    ))
+                    session = requests.Session()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.sessions[(host, retry)] = session
+        return session
+
+    def is_open(self, host: str) -> bool:
+        """Check whether the circuit of the host is open, i.e. requests should not be attempted"""
+        failures, opened = self.circuits.get(host, (0, None))
+        if failures < self.failure_threshold or opened is None:
+            return False
+        if time.monotonic() - opened >= self.reset_timeout:
+            # Half open: let this request through as a trial and hold back the others till it completes
+            self.circuits[host] = (failures, time.monotonic())
+            return False
+        return True
+
+    def record(self, host: str, success: bool):
+        """Update the circuit of the host with the outcome of a request"""
+        with self.lock:
+            if success:
+                self.circuits.pop(host, None)
+                return
+            failures, opened = self.circuits.get(host, (0, None))
+            failures += 1
+            self.circuits[host] = (failures, time.monotonic() if failures >= self.failure_threshold else opened)
+
+    def post(self, url: str, idempotent: bool = True, **kwargs) -> requests.Response:
+        """
+        Send a POST request through the pooled session of the url's host
+        :param url: URL of the endpoint
+        :param idempotent: Whether the request can safely be retried
+        :param kwargs: Any other arguments accepted by requests e.g. data, json, headers
+        :return: The response, which may have a 4xx status code
+        :raises UpstreamUnavailable: If the circuit is open or the upstream failed after all retries
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if self.is_open(host):
+                raise UpstreamUnavailable(f'Circuit for {host} is open')
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session(host, retry=idempotent).post(url, **kwargs)
+        except requests.RequestException as err:
+            self.record(host, False)
+            raise UpstreamUnavailable(f'Error reaching {url}\n{err}') from err
+        if response.status_code >= 500 or response.status_code == 429:
+            self.record(host, False)
+            raise UpstreamUnavailable(f'{url} RESPONSE: {response.text}\nSTATUS CODE: {response.status_code}')
+        self.record(host, True)
+        return response
@@ -3,7 +3,7 @@
 """
 This module will handle the errors that might arise from the system
 It will contain custom functions that redirect user to custom URLs when various errors occur
-and a function that logs the errors and informs the admin(s) when said errors occur
+and a function that logs the errors and informs the admin(s), in digests, when said errors occur
 """
 
 import os
@@ -14,7 +14,7 @@ import werkzeug.exceptions as ex
 from flask import jsonify
 from rq.registry import FailedJobRegistry
 from werkzeug.http import HTTP_STATUS_CODES
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 from app import app
 
@@ -38,6 +38,46 @@ abort = ex.Aborter()
 # here, we've set the timestamp, logging level, message, source file & line no where log entry originated
 LOG_FORMAT = "%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"
 
+# Name of the logger of the errors reported by the Flutter clients
+FLUTTER_LOGGER = 'flutter'
+
+
+def handle_blocking(handler, record):
+    """
+    Handle the record with a handler whose writes block e.g. on disk.
+    When eventlet has monkey patched the process, the write runs on a real OS thread through eventlet.tpool,
+    so that the hub keeps running the other green threads, while the handler's (green) lock is taken here
+    """
+    if not handler.filter(record):
+        return
+    handler.acquire()
+    try:
+        try:
+            from eventlet import patcher, tpool
+        except ImportError:
+            patcher = tpool = None
+        if tpool and patcher.is_monkey_patched('thread'):
+            tpool.execute(handler.emit, record)
+        else:
+            handler.emit(record)
+    finally:
+        handler.release()
+
+
+class BlockingHandler(logging.Handler):
+    """Wraps a handler whose writes block, see handle_blocking"""
+
+    def __init__(self, handler):
+        super().__init__(handler.level)
+        self.handler = handler
+
+    def emit(self, record):
+        handle_blocking(self.handler, record)
+
+    def close(self):
+        self.handler.close()
+        super().close()
+
 
 @app.errorhandler(404)
 def page_not_found(error):
@@ -64,6 +104,247 @@ def set_logger(filename):
     return file_handler
 
 
+class FileRouter(logging.Handler):
+    """
+    Writes each record to the log file named in its log_file attribute (infinite_pay.log by default),
+    relative to the folder of the router.
+    A rotating handler is created once per file and reused afterwards.
+    Only the most recently used files are kept open e.g. today's files, when file names carry the date
+    """
+
+    def __init__(self, folder, default='infinite_pay.log', max_open=32):
+        super().__init__(logging.INFO)
+        from collections import OrderedDict
+        self.folder = folder
+        self.default = default
+        self.max_open = max_open
+        self.handlers = OrderedDict()
+
+    def emit(self, record):
+        log_file = getattr(record, 'log_file', None) or self.default
+        handler = self.handlers.get(log_file)
+        if handler is None:
+            filename = f'{self.folder}/{log_file}'
+            # if log folder does not exist, create it
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            handler = self.handlers[log_file] = set_logger(filename)
+            while len(self.handlers) > self.max_open:
+                self.handlers.popitem(last=False)[1].close()
+        self.handlers.move_to_end(log_file)
+        handle_blocking(handler, record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+class DatabaseHandler(logging.Handler):
+    """Saves the records flagged with log_to_database as log messages in the database"""
+
+    def __init__(self, application):
+        super().__init__(logging.INFO)
+        self.application = application
+
+    def emit(self, record):
+        if not getattr(record, 'log_to_database', False):
+            return
+        from ..views import Sockets
+        with self.application.app_context():
+            Sockets.add_log_message({
+                'level': "exception" if record.levelno >= logging.ERROR else "info",
+                'message': record.getMessage(),
+                'source': "system",
+            })
+
+
+class ErrorAlertHandler(logging.Handler):
+    """
+    Emails the errors logged to the administrators as digests, at most one per window.
+    Errors are grouped by fingerprint, the exception type and the place the error was logged from,
+    and counted; only the first occurrence of a fingerprint in the window is kept in full.
+    The digest is sent from a background thread, so an error storm never puts SMTP on the hot path.
+    The counts of all processes are merged in Redis, and a single process sends the digest of each window
+    """
+
+    def __init__(self, application, window=300, max_entries=50):
+        """
+        :param application: The Flask application
+        :param window: Seconds between digests
+        :param max_entries: Maximum number of fingerprints detailed in a digest
+        """
+        super().__init__(logging.ERROR)
+        self.application = application
+        self.window = window
+        self.max_entries = max_entries
+        # Fingerprint -> dictionary of the count and first occurrence of the error
+        self.errors = {}
+        import threading
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @staticmethod
+    def tag(record):
+        """
+        Record the type of the exception, if any, on the record before it is queued,
+        since queueing formats the stack trace into the message and drops the exception
+        """
+        if record.exc_info and record.exc_info[0]:
+            record.error_type = record.exc_info[0].__name__
+        return True
+
+    @staticmethod
+    def fingerprint(record) -> str:
+        return f'{getattr(record, "error_type", None) or record.levelname} in {record.pathname}:{record.lineno}'
+
+    def emit(self, record):
+        import time
+        import threading
+        key = self.fingerprint(record)
+        with self.lock:
+            entry = self.errors.get(key)
+            if entry is None:
+                # Records are formatted before being queued, so the stack trace follows the first line of the message
+                message, _, traceback = record.getMessage().partition('\n')
+                self.errors[key] = {
+                    'count': 1, 'first_seen': time.time(), 'message': message[:1000], 'traceback': traceback[-4000:],
+                }
+            else:
+                entry['count'] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='error-alerts', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        import time
+        while True:
+            time.sleep(self.window)
+            try:
+                with self.application.app_context():
+                    self.flush()
+            except Exception as err:
+                # Reporting through the logger would feed this handler again
+                print(f'Error sending error digest\n{err}')
+
+    def flush(self):
+        """Merge the errors of this process into Redis and, if no other process has this window, send the digest"""
+        import json
+        with self.lock:
+            errors, self.errors = self.errors, {}
+        root = self.application.config["REDIS_ROOT"]
+        counts, samples = f'{root}_error_alerts', f'{root}_error_alerts_samples'
+        merged = False
+        try:
+            redis = self.application.redis
+            pipe = redis.pipeline(transaction=False)
+            for key, entry in errors.items():
+                pipe.hincrby(counts, key, entry['count'])
+                pipe.hsetnx(samples, key, json.dumps(entry))
+            pipe.execute()
+            merged = True
+            # The first process of the window sends the digest
+            if not redis.set(f'{root}_error_alerts_sent', 1, nx=True, ex=max(int(self.window) - 1, 1)):
+                return
+            pipe = redis.pipeline()
+            pipe.hgetall(counts)
+            pipe.hgetall(samples)
+            pipe.delete(counts, samples)
+            found, details, _ = pipe.execute()
+            errors = {}
+            for key, count in found.items():
+                entry = json.loads(details.get(key) or '{}')
+                entry['count'] = int(count)
+                errors[key.decode()] = entry
+        except Exception as err:
+            print(f'Error merging error digests\n{err}')
+            if merged:
+                # The errors are in Redis, and are sent by whichever process next claims a window
+                return
+            # Without Redis, every process sends the digest of its own errors
+        if errors:
+            self.send(errors)
+
+    def send(self, errors: dict):
+        import datetime
+        from ..communication import EmailCommunication
+        config = self.application.config
+        ranked = sorted(errors.items(), key=lambda item: item[1].get('count', 0), reverse=True)
+        total = sum(entry.get('count', 0) for _, entry in ranked)
+        lines = [f'{total} errors of {len(ranked)} kinds in the last {int(self.window) // 60 or 1} minutes\n']
+        for key, entry in ranked[:self.max_entries]:
+            first_seen = datetime.datetime.utcfromtimestamp(entry.get('first_seen', 0)).strftime('%Y-%m-%d %H:%M:%S')
+            lines.append(f'{entry.get("count", 0)} x {key} (first at {first_seen} UTC)\n{entry.get("message", "")}')
+            if entry.get('traceback'):
+                lines.append(entry['traceback'])
+            lines.append('-' * 40)
+        if len(ranked) > self.max_entries:
+            lines.append(f'... and {len(ranked) - self.max_entries} more kinds of errors')
+        EmailCommunication.send_email(
+            f'InfinitePay System Failure: {total} errors',
+            config.get('MAIL_DEFAULT_SENDER') or config.get('MAIL_USERNAME'),
+            list(config.get('ADMINS') or []),
+            text_body='\n'.join(lines),
+        )
+
+
+def configure_logging(application):
+    """
+    Set up logging once per process.
+    The application's logger only puts records on a queue; a background listener thread then writes them
+    to stdout or the log files, and to the database, so that handlers never block on I/O.
+    Under eventlet the listener is a green thread, like the database buffer and mail dispatcher it feeds,
+    and only its writes to disk or stdout are run on OS threads, see handle_blocking
+    :param application: The Flask application
+    :return: The queue listener
+    """
+    if getattr(application, 'log_listener', None):
+        return application.log_listener
+
+    import queue
+    import atexit
+    from flask.logging import default_handler
+
+    # If on an ephemeral system e.g. Heroku, log to stdout
+    if application.config.get('LOG_TO_STDOUT'):
+        stream = logging.StreamHandler()
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+        stream.setLevel(logging.INFO)
+        output = BlockingHandler(stream)
+    else:
+        output = FileRouter(application.config.get("LOG_FOLDER", "./logs") or "./logs")
+
+    records = queue.Queue(-1)
+    # Stack traces reported by the Flutter clients go to files of their own, per level and day
+    flutter = FileRouter(f'{application.config.get("UPLOAD_FOLDER", "./uploads") or "./uploads"}/flutter')
+    flutter.addFilter(lambda record: record.name == FLUTTER_LOGGER)
+    output.addFilter(lambda record: record.name != FLUTTER_LOGGER)
+    handlers = [output, flutter, DatabaseHandler(application)]
+    # Errors are emailed to the administrators if they and a mail server are set
+    if not application.debug and application.config.get('MAIL_SERVER') and application.config.get('ADMINS'):
+        application.error_alerts = ErrorAlertHandler(
+            application,
+            window=application.config.get('ERROR_ALERT_WINDOW', 300),
+            max_entries=application.config.get('ERROR_ALERT_MAX_ENTRIES', 50),
+        )
+        application.error_alerts.addFilter(lambda record: record.name != FLUTTER_LOGGER)
+        handlers.append(application.error_alerts)
+    application.log_listener = QueueListener(records, *handlers, respect_handler_level=True)
+    handler = QueueHandler(records)
+    handler.addFilter(ErrorAlertHandler.tag)
+    # Flask's own handler would write every record to stderr a second time, on the caller's thread
+    application.logger.removeHandler(default_handler)
+    application.logger.addHandler(handler)
+    application.logger.setLevel(logging.INFO)
+    flutter_logger = logging.getLogger(FLUTTER_LOGGER)
+    flutter_logger.addHandler(QueueHandler(records))
+    flutter_logger.setLevel(logging.INFO)
+    flutter_logger.propagate = False
+    application.log_listener.start()
+    atexit.register(application.log_listener.stop)
+    return application.log_listener
+
+
 def system_logging(msg, exception=True, log_file='infinite_pay.log'):
     """
     This is a function that handles system error logging,
@@ -71,43 +352,30 @@ def system_logging(msg, exception=True, log_file='infinite_pay.log'):
     The messages in log file will have as much information as possible.
     RotatingFileHandler rotates the logs, ensuring that the log files
     do not grow too large when the application runs for a long time.
-    The server writes a line to the logs each time it starts.
-    When this application runs on a production server, these log entries will tell you when the server was restarted.
-    :param: logs_folder = The folder that will contain the log file
+    The message is only queued here; writing it to the log file (or stdout) and the database
+    is done in the background by the listener set up in configure_logging
+    :param: log_file = The file in the logs folder that the message is written to
     """
     if exception:
         if app.debug:
             print(msg)
-        # Retry up to 3 times, with configurable intervals between retries
-        # TODO app.task_queue.enqueue_call(task_config['send_background_error_email'], timeout=3600, retry=Retry(3, 10))
+        # Administrators are emailed a digest of the errors, see ErrorAlertHandler
 
-    # Log message to database
-    from ..views import Sockets
-    Sockets.add_log_message({'level': "exception" if exception else "info", 'message': msg, 'source': "system"})
+    configure_logging(app)
 
-    # If on an ephemeral system e.g. Heroku, log to stdout
-    if app.config['LOG_TO_STDOUT']:
-        stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(logging.INFO)
-        app.logger.addHandler(stream_handler)
+    # Get and secure the log file
+    from werkzeug.utils import secure_filename
+    if not log_file or type(log_file) != str:
+        log_file = 'infinite_pay.log'
+    extra = {'log_file': secure_filename(log_file), 'log_to_database': True}
+    if isinstance(msg, BaseException):
+        # Exceptions are often logged after the except block, where the record would not know their type
+        extra['error_type'] = type(msg).__name__
+    # Records carry the location of the caller, which error alerts are grouped by, rather than this function's
+    if exception:
+        app.logger.exception(msg, extra=extra, stacklevel=2)
     else:
-        # Get and secure the log file
-        from werkzeug.utils import secure_filename
-        if not log_file or type(log_file) != str:
-            log_file = 'infinite_pay.log'
-        log_file = secure_filename(log_file)
-
-        # if log folder does not exist, create it
-        logs_folder = app.config.get("LOG_FOLDER", "./logs")
-        if not os.path.isdir(logs_folder):
-            os.makedirs(logs_folder)
-
-        app.logger.addHandler(set_logger(logs_folder + f'/{log_file}'))
-        app.logger.setLevel(logging.INFO)
-        if exception:
-            app.logger.exception(msg)
-        else:
-            app.logger.info(msg)
+        app.logger.info(msg, extra=extra, stacklevel=2)
 
 
 def check_failed_rq_jobs(queue_name='find_tasks', delete_job=False):
@@ -0,0 +1,83 @@
+# app/utils/intents.py
+
+"""
+This module contains the engine that detects what a client's message is about.
+Keywords are compiled once into a lookup table of normalized tokens,
+so matching a message costs the same no matter how many intents are defined
+"""
+
+import re
+
+
+class IntentMatcher:
+    """
+    Precompiled keyword matcher.
+    Every keyword (a word or a phrase) of an intent is a synonym for that intent.
+    Matching is case-insensitive, only considers whole words (plus common plural/verb suffixes)
+    and when several intents are found, the one with most keyword hits wins,
+    ties being broken by priority and then by order of declaration
+    """
+
+    TOKEN = re.compile(r"[^\W_]+")
+    SUFFIXES = ('ing', 'es', 'ed', 's')
+
+    def __init__(self, keywords: dict, priorities: dict = None):
+        """
+        :param keywords: Dictionary of intent name to an iterable of its keywords and synonyms
+        :param priorities: Optional dictionary of intent name to priority. Higher priority wins a tie
+        """
+        priorities = priorities if priorities and isinstance(priorities, dict) else {}
+        self.phrases = {}
+        self.ranks = {}
+        self.longest = 1
+        for position, (intent, words) in enumerate((keywords or {}).items()):
+            # Earlier declarations rank higher among intents of equal priority
+            self.ranks[intent] = (priorities.get(intent, 0) or 0, -position)
+            for word in words or ():
+                phrase = tuple(self.TOKEN.findall(str(word).casefold()))
+                if not phrase:
+                    continue
+                self.phrases.setdefault(phrase, intent)
+                self.longest = max(self.longest, len(phrase))
+
+    @classmethod
+    def normalize(cls, token: str):
+        """Yield the token and its stems, after stripping common suffixes"""
+        yield token
+        for suffix in cls.SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) > 2:
+                yield token[:-len(suffix)]
+
+    def scores(self, message: str) -> dict:
+        """
+        Count keyword hits per intent in the message
+        :param message: Message from the client
+        :return: Dictionary of intent name to number of hits
+        """
+        if not message or not isinstance(message, str):
+            return {}
+        tokens = self.TOKEN.findall(message.casefold())
+        scores = {}
+        for start in range(len(tokens)):
+            for length in range(min(self.longest, len(tokens) - start), 0, -1):
+                *head, tail = tokens[start:start + length]
+                intent = None
+                for stem in self.normalize(tail):
+                    intent = self.phrases.get((*head, stem))
+                    if intent:
+                        break
+                if intent:
+                    scores[intent] = scores.get(intent, 0) + 1
+                    break
+        return scores
+
+    def match(self, message: str):
+        """
+        Find the intent that best describes the message
+        :param message: Message from the client
+        :return: Name of the intent or None if no keyword was found
+        """
+        scores = self.scores(message)
+        if not scores:
+            return None
+        return max(scores, key=lambda intent: (scores[intent], self.ranks[intent]))
@@ -11,12 +11,12 @@ class Helper:
     def parse_url(cls, url: str) -> str:
         try:
             import re
-            from dotenv import dotenv_values
             from urllib.parse import urlparse
+            from settings import get_settings
 
             if not cls.detect_url(url):
                 return ''
-            if dotenv_values(".flaskenv").get('FLASK_ENV') == 'development':
+            if get_settings().is_development:
                 return f'{urlparse(url).scheme}://{urlparse(url).netloc}/'
             parsed = urlparse(url)
             scheme, netloc = parsed.scheme, parsed.netloc
@@ -66,18 +66,8 @@ class Helper:
     def generate_redis_url():
         """Get a link pointing to the Redis Server for use in background task queue among other uses"""
         try:
-            from dotenv import dotenv_values
-            app_config = dotenv_values('.env')
-            if dotenv_values(".flaskenv").get('FLASK_ENV') == 'development':
-                return app_config.get('REDIS_URL', '')
-            else:
-                redis_password = app_config.get('REDIS_PASSWORD', None)
-                if redis_password:
-                    redis_host = app_config.get('REDIS_HOST', 'localhost') or 'localhost'
-                    redis_port = int(app_config.get('REDIS_PORT', 6379) or 6379)
-                    return f'redis://:{redis_password}@{redis_host}:{redis_port}'
-                else:
-                    return app_config.get('REDIS_URL', '')
+            from settings import get_settings
+            return get_settings().redis_url
         except Exception as err:
             print(err)
             return 'redis://'
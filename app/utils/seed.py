@@ -0,0 +1,211 @@
+# app/utils/seed.py
+
+"""
+This module loads the existing financials (receipts, sales and transactions) into the database.
+Rows are inserted in bulk and rows already present, identified by their natural key, are skipped,
+so the loader can be run at every deployment
+"""
+
+import csv
+import json
+import uuid
+import itertools
+from operator import itemgetter
+
+from app import db
+
+from .errors import system_logging
+from ..models import ReceiptModel, SaleModel, TransactionModel
+
+
+class SeedLoader:
+    """
+    Bulk, idempotent loader of the financials snapshot.
+    Accepts the JSON export (an object of table name to list of rows) or a CSV export of a single table
+    """
+
+    # Table name in the export -> (model, natural key)
+    TABLES = {
+        'receipt': (ReceiptModel, ('merchant_id', 'created_at')),
+        'sales': (SaleModel, ('id_sale',)),
+        'transaction': (TransactionModel, ('transaction_id',)),
+    }
+
+    def __init__(self, batch_size=5000):
+        """
+        :param batch_size: Number of rows sent to the database per insert statement
+        """
+        self.batch_size = batch_size if batch_size and type(batch_size) == int else 5000
+
+    def statement(self, model, key):
+        """Build an insert statement for the model that skips rows whose natural key already exists"""
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # e.g. MySQL
+            return model.__table__.insert().prefix_with('IGNORE')
+        return insert(model.__table__).on_conflict_do_nothing(index_elements=list(key))
+
+    def load_rows(self, table: str, rows) -> int:
+        """
+        Insert the rows of a table in batches, committing after every batch. Rows that cannot be inserted are logged
+        :param table: Name of the table in the export i.e. receipt, sales or transaction
+        :param rows: Iterable of dictionaries, consumed lazily
+        :return: Number of rows processed
+        """
+        model, key = self.TABLES[table]
+        columns = [column.name for column in model.__table__.columns if column.name != 'id']
+        statement = self.statement(model, key)
+        count, batch = 0, []
+        for row in rows:
+            values = {column: row.get(column) for column in columns}
+            if any(values[column] in (None, '') for column in key):
+                continue
+            values['id'] = uuid.uuid4()
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                count += self.flush(statement, batch)
+                batch = []
+        if batch:
+            count += self.flush(statement, batch)
+        return count
+
+    @staticmethod
+    def flush(statement, batch: list) -> int:
+        """
+        Insert a batch of rows. If the batch fails, its rows are inserted one by one,
+        so that a bad row is logged and skipped without losing the rest of the batch
+        :return: Number of rows inserted
+        """
+        try:
+            db.session.execute(statement, batch)
+            db.session.commit()
+            return len(batch)
+        except Exception:
+            db.session.rollback()
+        count = 0
+        for row in batch:
+            try:
+                db.session.execute(statement, [row])
+                db.session.commit()
+                count += 1
+            except Exception as err:
+                db.session.rollback()
+                system_logging(f'Unable to load row {row}\n{err}', exception=True)
+        return count
+
+    @staticmethod
+    def stream_json(fp, chunk_size=1 << 16):
+        """
+        Parse a JSON export (an object of table name to list of rows) one row at a time,
+        so that only the row being parsed, rather than the whole export, is held in memory
+        :param fp: File of the export, opened for reading text
+        :return: Generator of (table name, row) tuples, in the order of the file
+        """
+        decoder = json.JSONDecoder()
+        state = {'buffer': '', 'position': 0, 'eof': False}
+
+        def peek() -> str:
+            # Next character that is not whitespace, reading more of the file as needed
+            while True:
+                buffer, position = state['buffer'], state['position']
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                state['position'] = position
+                if position < len(buffer):
+                    return buffer[position]
+                if state['eof']:
+                    raise ValueError(f'Unexpected end of JSON export at character {position}')
+                read()
+
+        def read():
+            chunk = fp.read(chunk_size)
+            state['buffer'] = state['buffer'][state['position']:] + chunk
+            state['position'] = 0
+            state['eof'] = not chunk
+
+        def expect(characters: str) -> str:
+            character = peek()
+            if character not in characters:
+                raise ValueError(f'Expected one of {characters!r} in JSON export, found {character!r}')
+            state['position'] += 1
+            return character
+
+        def value():
+            peek()
+            while True:
+                try:
+                    result, end = decoder.raw_decode(state['buffer'], state['position'])
+                except json.JSONDecodeError:
+                    # The value may run past the end of what has been read
+                    if state['eof']:
+                        raise
+                    read()
+                    continue
+                # A number could be cut short by the end of what has been read, e.g. 1 of 1.25
+                rest = state['buffer'][end:]
+                cut = isinstance(result, (int, float)) and rest.strip('0123456789.eE+-') == ''
+                if cut and not state['eof']:
+                    read()
+                    continue
+                state['position'] = end
+                return result
+
+        expect('{')
+        if peek() == '}':
+            return
+        while True:
+            table = value()
+            expect(':')
+            if peek() == '[':
+                expect('[')
+                if peek() != ']':
+                    while True:
+                        yield table, value()
+                        if expect(',]') == ']':
+                            break
+                else:
+                    expect(']')
+            else:
+                # Not a list of rows, so nothing to load
+                value()
+            if expect(',}') == '}':
+                return
+
+    def load_json(self, path: str) -> dict:
+        """
+        Stream a JSON export e.g. database.json
+        :return: Dictionary of table name to number of rows processed
+        """
+        counts = dict.fromkeys(self.TABLES, 0)
+        with open(path) as fp:
+            try:
+                for table, group in itertools.groupby(self.stream_json(fp), key=itemgetter(0)):
+                    if table not in self.TABLES:
+                        continue
+                    # A table that cannot be loaded does not stop the others
+                    try:
+                        counts[table] += self.load_rows(table, (row for _, row in group))
+                    except Exception as err:
+                        db.session.rollback()
+                        system_logging(f'Unable to load table {table} from {path}\n{err}', exception=True)
+            except ValueError as err:
+                # json.JSONDecodeError included. The tables read before the error remain loaded
+                system_logging(f'Unable to parse {path}\n{err}', exception=True)
+        return counts
+
+    def load_csv(self, path: str, table: str) -> dict:
+        """
+        Stream a CSV export of a single table, whose header holds the column names
+        :return: Dictionary of table name to number of rows processed
+        """
+        with open(path, newline='') as fp:
+            return {table: self.load_rows(table, csv.DictReader(fp))}
+
+    def load(self, path: str, table: str = None) -> dict:
+        if path.lower().endswith('.csv'):
+            return self.load_csv(path, table)
+        return self.load_json(path)
@@ -6,10 +6,14 @@ and that shall require running in a background task queue
 """
 
 import sys
+import zlib
+import time
+from datetime import datetime
 from rq.job import Job
 from rq import get_current_job
+from rq.worker import SimpleWorker
 
-from ..models import TaskModel, ConversationModel
+from ..models import ConversationModel, MessageModel
 from ..communication import EmailCommunication
 from app import create_app
 
@@ -18,10 +22,18 @@ class BackgroundTaskError(Exception):
     pass
 
 
+class DeadlinePassed(BackgroundTaskError):
+    """Raised, for its failure callback, for a job dropped as its deadline passed before it could run"""
+
+
 class TaskUtil:
     @staticmethod
     def get_app():
         # Get a Flask application instance and application context
+        # They are created once per process and reused by every job and callback that follows
+        from flask import current_app, has_app_context
+        if has_app_context():
+            return current_app._get_current_object()
         app = create_app()
         app.app_context().push()
         return app
@@ -53,37 +65,31 @@ class TaskUtil:
         app = cls.get_app()
         try:
             job = get_current_job()
-            conversations = ConversationModel.query.all()
-            for conversation in conversations:
-                msg = ConversationModel.retrieve_conversations([conversation])[0]['messages'][-1]
-                if msg['is_client']:
-                    from ..views import socketIO
-                    from ..controllers import SocketsController
-                    response = SocketsController.initiate_conversation(msg['message'], msg['conversation_id'])
-                    SocketsController.save_message(response, msg['conversation_id'], sender='system')
-                    socketIO.emit("received message", {"message": response, "id": msg['conversation_id']})
-                    import re
-                    if re.search("Thank", response):
-                        intro = "Welcome to Infinite Pay support center. How can we be of assistance?"
-                        SocketsController.save_message(intro, msg['conversation_id'], sender='system', )
-                        socketIO.emit("received message", {"message": intro, "id": msg['conversation_id']})
-            # If launched at startup
-            if job.meta['startup']:
+            from ..controllers import TasksController
+            # Only conversations whose latest message is from the client are read
+            # They are split into shards by hash of their ID, and each shard into chunks of at most SWEEP_CHUNK_SIZE,
+            # each chunk being answered by its own job so that the backlog is shared among all workers
+            shards, size = app.config.get('SWEEP_SHARDS', 8), app.config.get('SWEEP_CHUNK_SIZE', 25)
+            buckets = [[] for _ in range(shards)]
+            # Recent messages are left to process_conversation, which enqueue_message queued them for
+            for conversation in ConversationModel.awaiting_reply(older_than=app.config.get('SWEEP_GRACE_PERIOD', 60)):
+                uid = conversation.conversation_id
+                buckets[zlib.crc32(uid.encode()) % shards].append(uid)
+            chunks = [bucket[i:i + size] for bucket in buckets for i in range(0, len(bucket), size)]
+            for position, chunk in enumerate(chunks):
+                # Chunks not answered within a minute are dropped, as the next sweep finds them again
+                TasksController.launch_task(
+                    'answer_conversations', f"Answer {len(chunk)} unanswered conversations", None, chunk, deadline=60,
+                )
+                if job:
+                    cls.update_job(job, int(100 * (position + 1) / len(chunks)) - 1, f'Queued {position + 1} chunks')
+            # If launched at startup, rerun this task periodically
+            if job and job.meta.get('startup'):
                 from ..controllers import TasksController
                 from datetime import datetime, timedelta
                 import pytz
 
-                # Cancel any previous repeated task
-                repeated_task = TasksController.get_scheduled_task_in_progress('handle_unhandled_messages')
-                if repeated_task:
-                    result = TasksController.cancel_scheduled_task(repeated_task['id'])
-                    if result:
-                        app.logger.exception(
-                            result if isinstance(result, str) else "Error cancelling repeated tasks",
-                            exc_info=(),
-                        )
-
-                # Rerun this task periodically
+                # Keyed, so that a single periodic task runs however many processes start up
                 TasksController.schedule_task(
                     'handle_unhandled_messages',
                     "Handle unanswered messages",
@@ -92,23 +98,140 @@ class TaskUtil:
                     interval=1 * 60,  # Run this periodic task every hour (set in seconds)
                     repeat=None,  # Repeat forever
                     meta={'startup': False},  # Data to be set on meta of task
+                    key='handle_unhandled_messages',
                 )
         except Exception as err:
             app.logger.exception(f'Unhandled exception reacting to unanswered message\n{err}', exc_info=sys.exc_info())
 
+    @classmethod
+    def answer_conversations(cls, conversation_ids: list):
+        """
+        Answer the given conversations, if still awaiting a reply
+        Each conversation is locked while being answered, so that no two workers answer the same conversation
+        :param conversation_ids: IDs of the conversations, one chunk of those found by handle_unhandled_messages
+        """
+        app = cls.get_app()
+        job = get_current_job()
+        from ..views import send_to_conversation
+        from ..controllers import SocketsController
+        answered = 0
+        for position, uid in enumerate(conversation_ids or []):
+            try:
+                # Messages waiting in the conversation's mailbox are answered by process_conversation
+                # It is queued again, in case the job that was to answer them was lost e.g. timed out
+                if app.redis.llen(SocketsController.mailbox_key(uid)) or \
+                        app.redis.llen(SocketsController.processing_key(uid)):
+                    SocketsController.process_mailbox(uid)
+                    continue
+                lock = app.redis.lock(SocketsController.lock_key(uid), timeout=60)
+                # Skip a conversation being answered by another worker, rather than wait for it
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    messages, _ = MessageModel.retrieve_page(uid, limit=1)
+                    if not messages or not messages[-1]['is_client']:
+                        continue
+                    for reply in SocketsController.answer(messages[-1]['message'], uid, is_saved=True):
+                        send_to_conversation("received message", {"message": reply, "id": uid}, uid)
+                    answered += 1
+                finally:
+                    lock.release()
+            except Exception as err:
+                app.logger.exception(
+                    f'Unhandled exception answering conversation {uid}\n{err}', exc_info=sys.exc_info(),
+                )
+            finally:
+                if job:
+                    progress = int(100 * (position + 1) / len(conversation_ids)) - 1
+                    cls.update_job(job, progress, f'{answered} of {len(conversation_ids)} conversations answered')
+        return {'progress': 100, 'message': f'{answered} of {len(conversation_ids or [])} conversations answered'}
+
+    @classmethod
+    def process_conversation(cls, uid: str):
+        """
+        Answer the messages waiting in the conversation's mailbox, in the order they were received
+        Only one worker drains a mailbox at a time; others return straight away, leaving their messages to it.
+        The message being answered is moved to a processing list and only removed from it once its turn is committed,
+        so that a message whose worker died is answered by the next job of the conversation
+        :param uid: ID of the conversation
+        """
+        app = cls.get_app()
+        from redis.exceptions import LockError
+        from ..views import send_to_conversation
+        from ..controllers import SocketsController
+        mailbox, processing = SocketsController.mailbox_key(uid), SocketsController.processing_key(uid)
+        attempts_key = f'{processing}:attempts'
+        batch_size = app.config.get('MAILBOX_BATCH_SIZE', 10)
+        max_attempts = app.config.get('MAILBOX_MAX_ATTEMPTS', 3)
+        answered = 0
+        # Check again after releasing the lock, for messages pushed while the lock was being released
+        while app.redis.llen(mailbox) or app.redis.llen(processing):
+            if answered >= batch_size:
+                # Leave the rest to another job, so that other conversations get their turn on the workers
+                SocketsController.process_mailbox(uid)
+                return
+            lock = app.redis.lock(SocketsController.lock_key(uid), timeout=60)
+            if not lock.acquire(blocking=False):
+                return
+            try:
+                # A message left in processing was not answered, hence goes back to the head of the mailbox
+                while app.redis.lmove(processing, mailbox, 'RIGHT', 'LEFT'):
+                    pass
+                while answered < batch_size:
+                    # Extend the lock for every message, so that it does not expire while the mailbox is drained
+                    lock.reacquire()
+                    message = app.redis.lmove(mailbox, processing, 'LEFT', 'RIGHT')
+                    if message is None:
+                        break
+                    if app.redis.incr(attempts_key) > max_attempts:
+                        # The message is saved, so the sweep answers it once the conversation can be answered again
+                        app.logger.error(f'Gave up answering message of conversation {uid} after {max_attempts} tries')
+                        replies = ['Unable to continue. Please refresh page']
+                    else:
+                        replies = SocketsController.answer(message.decode(), uid, is_saved=True)
+                        if replies[0].startswith('Unable to continue'):
+                            # Not committed, so the message stays in processing and is tried again
+                            break
+                    pipe = app.redis.pipeline()
+                    pipe.lrem(processing, 1, message)
+                    pipe.delete(attempts_key)
+                    pipe.execute()
+                    answered += 1
+                    for reply in replies:
+                        send_to_conversation("received message", {"message": reply, "id": uid}, uid)
+            except Exception as err:
+                app.logger.exception(
+                    f'Unhandled exception processing conversation {uid}\n{err}', exc_info=sys.exc_info(),
+                )
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    # The lock expired, and may be held by another worker already
+                    app.logger.warning(f'Lock of conversation {uid} expired before being released')
+
     @staticmethod
-    def update_job(job: Job, progress=0.0, message=''):
+    def completed_key() -> str:
+        """Redis set of the IDs of the tasks completed, but not yet marked complete in the database"""
+        from flask import current_app
+        return f'{current_app.config["REDIS_ROOT"]}_tasks_completed'
+
+    @staticmethod
+    def metrics_key() -> str:
+        """Redis hash of the wait time and drop counters of every queue, see AppWorker"""
+        from flask import current_app
+        return f'{current_app.config["REDIS_ROOT"]}_queue_metrics'
+
+    @classmethod
+    def update_job(cls, job: Job, progress=0.0, message=''):
         job = job if job else get_current_job()
         # Write the percentage and message to the job.meta dictionary and saves it to Redis
         job.meta['progress'] = progress
         job.meta['message'] = message
         job.save_meta()
-        # Load the corresponding task object from the database
-        task = TaskModel.query.get(job.get_id())
-        if task:
-            if progress >= 100:
-                task.complete = True
-            task.save()
+        if progress >= 100:
+            # Tasks are marked complete in the database in batches, see TasksController.sync_completed
+            job.connection.sadd(cls.completed_key(), job.get_id())
 
     @staticmethod
     def count_words_at_url(url):
@@ -117,9 +240,93 @@ class TaskUtil:
         print(len(resp.text.split()))
 
 
+class AppWorker(SimpleWorker):
+    """
+    RQ worker that sets up the Flask application once, when the worker starts,
+    and runs every job in its own process, within that application's context and database pool.
+    Queues are drained in the order given, so list them from the highest priority, see priority_queues.
+    Jobs whose deadline has passed by the time they are dequeued are dropped rather than run late.
+    Start it with `flask worker` or `rq worker -w app.utils.AppWorker <queues>`
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.app = TaskUtil.get_app()
+        super().__init__(*args, **kwargs)
+
+    def record_start(self, job, queue, dropped: bool = False):
+        """
+        Add the time the job waited in its queue to the queue's metrics
+        A dropped job is only counted as dropped, so that the started jobs and their waits are those of jobs that ran
+        """
+        key = TaskUtil.metrics_key()
+        if dropped:
+            self.connection.hincrby(key, f'{queue.name}:dropped', 1)
+            return
+        waited = (datetime.utcnow() - job.enqueued_at).total_seconds() if job.enqueued_at else 0.0
+        waited = max(waited, 0.0)
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.hincrby(key, f'{queue.name}:started', 1)
+        pipe.hincrbyfloat(key, f'{queue.name}:waited', waited)
+        pipe.hset(key, f'{queue.name}:last_wait', waited)
+        pipe.execute()
+
+    def perform_job(self, job, queue):
+        deadline = job.meta.get('deadline')
+        expired = bool(deadline and deadline < time.time())
+        try:
+            self.record_start(job, queue, dropped=expired)
+        except Exception as err:
+            self.app.logger.exception(f'Error recording metrics of queue {queue.name}\n{err}', exc_info=sys.exc_info())
+        try:
+            if expired:
+                self.app.logger.warning(f'Dropped job {job.id} ({job.func_name}): its deadline passed before it ran')
+                self.drop_job(job, queue)
+                return False
+            return super().perform_job(job, queue)
+        finally:
+            from app import db
+            # Return the job's connection to the pool, so that the next job starts with a clean session
+            db.session.remove()
+
+    def drop_job(self, job, queue):
+        """
+        Fail a job whose deadline passed before it could run, as if it had raised DeadlinePassed,
+        running its failure callback (e.g. report_failure) and moving it to the failed job registry
+        """
+        err = DeadlinePassed('Deadline passed before the job could run')
+        if job.failure_callback:
+            try:
+                job.failure_callback(job, self.connection, DeadlinePassed, err, None)
+            except Exception as error:
+                self.app.logger.exception(f'Error running failure callback of job {job.id}\n{error}',
+                                          exc_info=sys.exc_info())
+        TaskUtil.update_job(job, 100, 'Dropped: the deadline passed before the job could run')
+        # A late job would only be late again, so it is not retried
+        job.retries_left = 0
+        self.handle_job_failure(job, queue=queue, exc_string=str(err))
+
+
+# Priority class -> Suffix of the name of its queue, from the highest priority to the lowest
+priority_queues = {
+    # Work a client is waiting on e.g. replies to messages
+    'interactive': 'replies',
+    'default': 'tasks',
+    # Maintenance that can wait e.g. sweeps of unanswered conversations
+    'bulk': 'bulk',
+}
+
 task_config = {
     'send_background_error_email': TaskUtil.send_background_error_email,
     'handle_unhandled_messages': TaskUtil.handle_unhandled_messages,
+    'answer_conversations': TaskUtil.answer_conversations,
+    'process_conversation': TaskUtil.process_conversation,
     'send_background_email': TaskUtil.send_background_email,
     'count_words_at_url': TaskUtil.count_words_at_url,
 }
+
+# Priority class of the tasks that do not run in the default one
+task_priority = {
+    'process_conversation': 'interactive',
+    'handle_unhandled_messages': 'bulk',
+    'count_words_at_url': 'bulk',
+}
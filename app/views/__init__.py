@@ -4,9 +4,10 @@
 This defines functions that a users directly interact with
 """
 
-from .sockets import Sockets, socketIO
+from .sockets import Sockets, socketIO, send_to_conversation
 
 app_views = {
     Sockets.__name__: Sockets,
     "socketIO": socketIO,
+    "send_to_conversation": send_to_conversation,
 }
@@ -5,37 +5,74 @@ import pytz
 import uuid
 
 from datetime import datetime
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 
 from app import app
 
-from ..utils import Helper
-from ..models import LogModel
+from ..utils import Helper, FLUTTER_LOGGER
+from ..models import LogModel, WriteBehindBuffer, Serializer
 from ..controllers import SocketsController
 
 REDIS_URL = Helper.generate_redis_url()
 
 # Start SocketIO server, allow CORS and connect to a message queue e.g. Redis
-socketIO = SocketIO(app, cors_allowed_origins="*", message_queue=REDIS_URL if type(REDIS_URL) == str else 'redis://')
+# The message queue relays emits between gunicorn workers (and RQ workers), so a room emit reaches its client
+# regardless of which process holds the client's socket
+# Payloads, serialized rows included, are encoded to JSON by orjson through Serializer
+socketIO = SocketIO(
+    app, cors_allowed_origins="*", message_queue=REDIS_URL if type(REDIS_URL) == str else 'redis://', json=Serializer,
+)
+
+
+def send_to_conversation(event, data, conversation_id):
+    """
+    Emit an event only to the clients in the room of the given conversation
+    Without a conversation ID, the event is sent back to the client that triggered the current socket event
+    :param event: Name of the event to be emitted
+    :param data: Payload of the event
+    :param conversation_id: ID of the conversation whose room is to receive the event
+    :return: None
+    """
+    if conversation_id and isinstance(conversation_id, str):
+        socketIO.emit(event, data, to=conversation_id)
+    else:
+        emit(event, data)
 
 
 class Sockets:
+    # Buffer of log messages, created on first use
+    LOG_BUFFER = None
 
     @staticmethod
     @socketIO.on('setup')
     def setup(data):
-        conversation = SocketsController.retrieve_conversation(data.get('id'))
+        uid = data.get('id')
+        if uid and isinstance(uid, str):
+            # Every conversation has its own room, so that replies are not broadcast to all connected clients
+            join_room(uid)
+        conversation = SocketsController.retrieve_conversation(uid)
         if not conversation:
-            messages = [
+            history = dict(messages=[
                 {
                     "message": 'Welcome to Infinite Pay support center. How can we be of assistance?',
                     "is_client": False
                 },
-            ]
+            ], cursor=None)
         else:
-            from ..models import ConversationModel
-            messages = ConversationModel.retrieve_conversations([conversation])[0]['messages']
-        socketIO.emit('setup complete', dict(messages=messages, id=data.get('id')))
+            # Only the latest messages are sent. Older ones are requested page by page through 'load history'
+            history = SocketsController.retrieve_history(uid)
+        # Other clients in the conversation's room already have the history
+        emit('setup complete', dict(history, id=uid))
+
+    @staticmethod
+    @socketIO.on('load history')
+    def load_history(data):
+        uid, cursor = data.get('id'), data.get('cursor')
+        if not uid or not isinstance(uid, str) or not cursor or not isinstance(cursor, str):
+            emit('history page', dict(messages=[], cursor=None, id=uid))
+            return
+        # Only the client scrolling back needs the page, not every client in the conversation's room
+        emit('history page', dict(SocketsController.retrieve_history(uid, cursor), id=uid))
 
     @staticmethod
     @socketIO.on('add message')
@@ -43,27 +80,49 @@ class Sockets:
         uid = data.get('id')
         message = data.get('message')
         channel = 'received message'
+        if not uid or not isinstance(uid, str):
+            emit(channel, dict(message='Unable to continue. Please refresh page', id=uid))
+            return
+        # Rejoin in case the socket reconnected without running setup again
+        join_room(uid)
         if not message or not isinstance(message, str):
-            socketIO.emit(channel, dict(message='Please enter your message', id=uid))
+            send_to_conversation(channel, dict(message='Please enter your message', id=uid), uid)
+            return
+        if app.config.get('PROCESS_MESSAGES_IN_BACKGROUND'):
+            # Replies are emitted to the conversation's room by the worker, through the message queue
+            error = SocketsController.enqueue_message(message, uid)
+            if error:
+                send_to_conversation(channel, {"message": error, "id": uid}, uid)
             return
-        response = SocketsController.initiate_conversation(message, uid)
-        SocketsController.save_message(response, uid, sender='system')
-        socketIO.emit(channel, {"message": response, "id": uid})
-        import re
-        if re.search("Thank", response):
-            intro = "Welcome to Infinite Pay support center. How can we be of assistance?"
-            SocketsController.save_message(intro, uid, sender='system', )
-            socketIO.emit(channel, {"message": intro, "id": uid})
+        # The whole turn (client message, action and replies) is written in a single transaction
+        for reply in SocketsController.answer(message, uid):
+            send_to_conversation(channel, {"message": reply, "id": uid}, uid)
 
     @staticmethod
     @socketIO.on('my_ping')
     def my_ping():
-        socketIO.emit('my_pong')
+        # Only the client that sent the ping needs the pong
+        emit('my_pong')
+
+    @classmethod
+    def log_buffer(cls) -> WriteBehindBuffer:
+        """Buffer of log messages, flushed in bulk to the database every LOG_BATCH_SIZE records or LOG_FLUSH_INTERVAL"""
+        if cls.LOG_BUFFER is None:
+            cls.LOG_BUFFER = WriteBehindBuffer(
+                interval=app.config.get('LOG_FLUSH_INTERVAL', 0.25),
+                max_size=app.config.get('LOG_BUFFER_SIZE', 10000),
+                batch_size=app.config.get('LOG_BATCH_SIZE', 500),
+            )
+        return cls.LOG_BUFFER
 
     @staticmethod
     @socketIO.on('add log')
     def add_log_message(data):
-        """Add a log message"""
+        """
+        Add a log message
+        The message is only buffered here and written to the database in bulk in the background.
+        When the buffer is full, the message is dropped and counted in the buffer's dropped counter
+        """
         try:
             if not data.get('timestamp') or type(data.get('timestamp')) is not str:
                 timestamp = datetime.now(tz=pytz.timezone('Africa/Nairobi'))
@@ -74,45 +133,26 @@ class Sockets:
             level = data.get('level') or "info"
             filename = None
             if stack_trace:
-                import os
                 import logging
+                from werkzeug.utils import secure_filename
 
-                # Create a custom logger
-                logger = logging.getLogger(__name__)
-
-                # if log folder does not exist, create it
-                log_folder = f'{app.config.get("UPLOAD_FOLDER", "./uploads") or "./uploads"}/flutter/{level}'
-                if not os.path.isdir(log_folder):
-                    os.makedirs(log_folder)
-
-                # Create handlers
-                filename = f'{log_folder}/error_{timestamp.strftime("%Y_%m_%d")}.log'
-                f_handler = logging.FileHandler(filename=filename)
-
-                # Create formatters
-                f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-                # Add formatter to handlers
-                f_handler.setFormatter(f_format)
-
-                # Add handlers to the logger
-                logger.addHandler(f_handler)
+                # Written in the background to the file of the level and day, see configure_logging
+                log_file = f'{secure_filename(level) or "info"}/error_{timestamp.strftime("%Y_%m_%d")}.log'
+                filename = f'{app.config.get("UPLOAD_FOLDER", "./uploads") or "./uploads"}/flutter/{log_file}'
 
                 # Log stack trace
-                logger.error(
-                    f"{data.get('message')} from {data.get('source')} on platform {data.get('platform')}\n{stack_trace}"
-                )
+                message = f"{data.get('message')} from {data.get('source')} on platform {data.get('platform')}"
+                logging.getLogger(FLUTTER_LOGGER).error(f"{message}\n{stack_trace}", extra={'log_file': log_file})
 
-            status = LogModel(
+            Sockets.log_buffer().add(LogModel, dict(
                 id=uuid.uuid4(),
                 message=data.get('message') or "",
                 source=data.get('source') or "",
                 platform=data.get('platform'),
                 timestamp=timestamp,
+                created_on=datetime.now(tz=pytz.timezone('Africa/Nairobi')),
                 log_file=filename,
                 level=level,
-            ).save()
-            if status:
-                app.logger.exception(f'Error Problem adding log message', exc_info=())
+            ))
         except Exception as err:
             app.logger.exception(f'Unhandled exception adding log message\n{err}', exc_info=sys.exc_info())
@@ -7,8 +7,12 @@ This file contains the configurations for different environments
 import os
 import json
 
+from settings import get_settings
+
 # Here, we obtain environment variables directly from computer
 # Useful for running in a terminal
+# Loading the settings first exports the variables of .env, if any
+SETTINGS = get_settings()
 
 SERVER_NAME = os.environ.get("SERVER_NAME")
 
@@ -34,7 +38,8 @@ class Config(object):
     # Redis configurations
     REDIS_HOST = os.environ.get("REDIS_HOST") or 'localhost'
     REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD") or ''
-    REDIS_URL = os.environ.get("REDIS_URL") or 'redis://'
+    # Link built from the variables above, or REDIS_URL
+    REDIS_URL = SETTINGS.redis_url
     REDIS_PORT = int(os.environ.get("REDIS_PORT", '6379') or 6379)
     REDIS_ROOT = os.environ.get("REDIS_ROOT") or 'cloudwalk'
     # Define path for logs folder
@@ -53,8 +58,17 @@ class Config(object):
     # mail server credentials, optional
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    # Emails are sent by MAIL_CONCURRENCY threads, each sending up to MAIL_BATCH_SIZE emails per SMTP connection
+    # and closing it after MAIL_IDLE_TIMEOUT seconds without emails. At most MAIL_QUEUE_SIZE emails wait to be sent
+    MAIL_CONCURRENCY = int(os.environ.get('MAIL_CONCURRENCY') or 2)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT') or 5)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 1000)
     # list of the email addresses that will receive error reports
     ADMINS = json.loads(os.environ.get("ADMINS", "[]") or '[]') or []
+    # Errors are reported in a digest every ERROR_ALERT_WINDOW seconds, detailing up to ERROR_ALERT_MAX_ENTRIES kinds
+    ERROR_ALERT_WINDOW = int(os.environ.get('ERROR_ALERT_WINDOW') or 300)
+    ERROR_ALERT_MAX_ENTRIES = int(os.environ.get('ERROR_ALERT_MAX_ENTRIES') or 50)
     # Default administrator details
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'administrator')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', None)
@@ -68,6 +82,52 @@ class Config(object):
     REAL_EMAIL_API_KEY = os.environ.get("REAL_EMAIL_API_KEY")
     # Indicates whether to log to stdout or to a file
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    # Log messages are written to the database in batches of LOG_BATCH_SIZE or every LOG_FLUSH_INTERVAL seconds
+    # At most LOG_BUFFER_SIZE messages are held, beyond which messages are dropped
+    LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE') or 500)
+    LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL') or 0.25)
+    LOG_BUFFER_SIZE = int(os.environ.get('LOG_BUFFER_SIZE') or 10000)
+    # JSON file with additional intents (problem types) for the bot, loaded at startup
+    INTENTS_FILE = os.environ.get('INTENTS_FILE')
+    # Upstream APIs' client: timeouts and backoff in seconds, connections kept alive per host
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT') or 3.05)
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT') or 10)
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES') or 2)
+    HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF') or 0.3)
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE') or 10)
+    # Consecutive failures before an upstream is considered down, and seconds before it is tried again
+    HTTP_CIRCUIT_FAILURES = int(os.environ.get('HTTP_CIRCUIT_FAILURES') or 5)
+    HTTP_CIRCUIT_RESET = float(os.environ.get('HTTP_CIRCUIT_RESET') or 30)
+    # Number of lookups run concurrently per process, and seconds to wait for all lookups of a message
+    LOOKUP_WORKERS = int(os.environ.get('LOOKUP_WORKERS') or 32)
+    LOOKUP_DEADLINE = float(os.environ.get('LOOKUP_DEADLINE') or 10)
+    # Number of messages sent per page of a conversation's history, and seconds older pages are cached
+    HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE') or 50)
+    HISTORY_CACHE_TTL = int(os.environ.get('HISTORY_CACHE_TTL') or 600)
+    # Answer clients' messages in RQ workers (see `flask worker`) rather than in the socket handlers
+    PROCESS_MESSAGES_IN_BACKGROUND = os.environ.get('PROCESS_MESSAGES_IN_BACKGROUND', '1') not in ('0', 'false')
+    # Write messages from a background buffer, group committed every MESSAGE_FLUSH_INTERVAL seconds
+    MESSAGE_WRITE_BEHIND = (os.environ.get('MESSAGE_WRITE_BEHIND') or '0') not in ('0', 'false', 'False')
+    MESSAGE_FLUSH_INTERVAL = float(os.environ.get('MESSAGE_FLUSH_INTERVAL') or 0.005)
+    # External chats API: polled every CHATS_POLL_INTERVAL seconds, each known conversation rechecked at most every
+    # CHATS_REFRESH_INTERVAL seconds, with up to CHATS_CONCURRENCY conversations handled at the same time
+    CHATS_URL = os.environ.get('CHATS_URL') or 'https://chats-api-dot-active-thunder-329100.rj.r.appspot.com'
+    CHATS_POLL_INTERVAL = float(os.environ.get('CHATS_POLL_INTERVAL') or 5)
+    CHATS_REFRESH_INTERVAL = float(os.environ.get('CHATS_REFRESH_INTERVAL') or 30)
+    CHATS_CONCURRENCY = int(os.environ.get('CHATS_CONCURRENCY') or 16)
+    # Unanswered conversations are split into this many shards, answered in jobs of at most SWEEP_CHUNK_SIZE each
+    SWEEP_SHARDS = int(os.environ.get('SWEEP_SHARDS') or 8)
+    SWEEP_CHUNK_SIZE = int(os.environ.get('SWEEP_CHUNK_SIZE') or 25)
+    # Seconds a new message is left to process_conversation before the sweep answers it
+    SWEEP_GRACE_PERIOD = float(os.environ.get('SWEEP_GRACE_PERIOD') or 60)
+    # Messages answered per job from a conversation's mailbox, and tries at answering each before giving up on it
+    MAILBOX_BATCH_SIZE = int(os.environ.get('MAILBOX_BATCH_SIZE') or 10)
+    MAILBOX_MAX_ATTEMPTS = int(os.environ.get('MAILBOX_MAX_ATTEMPTS') or 3)
+    # Seconds the state of an idle conversation is kept in Redis
+    CONVERSATION_STATE_TTL = int(os.environ.get('CONVERSATION_STATE_TTL') or 24 * 60 * 60)
+    # Number of upstream responses cached per process, and whether to share them across workers through Redis
+    CACHE_SIZE = int(os.environ.get('CACHE_SIZE') or 4096)
+    CACHE_USE_REDIS = (os.environ.get('CACHE_USE_REDIS') or '1') not in ('0', 'false', 'False')
 
 
 class DevelopmentConfig(Config):
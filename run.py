@@ -36,12 +36,7 @@ elif async_mode == 'gevent':
     monkey.patch_all()
 
 from app import create_app
-
-from dotenv import dotenv_values, load_dotenv
-
-flask_config = dotenv_values(".flaskenv")
-
-load_dotenv('.env')
+from settings import get_settings
 
 app = create_app()
 CONSTANTS = {}
@@ -73,11 +68,6 @@ def make_shell_context():
 if __name__ == '__main__':
     from app.views import socketIO
 
-    port = flask_config.get('FLASK_RUN_PORT')
+    settings = get_settings()
     # Run SocketIO server which is robust and incorporates standard Flask development server startup
-    socketIO.run(
-        app,
-        debug=app.debug,
-        host=flask_config.get('FLASK_RUN_HOST', 'localhost'),
-        port=int(port if port and type(port) == str and port.isnumeric() else 5000),
-    )
+    socketIO.run(app, debug=app.debug, host=settings.run_host, port=settings.run_port)
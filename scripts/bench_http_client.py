@@ -0,0 +1,109 @@
+# scripts/bench_http_client.py
+
+"""
+Latency of upstream lookups with and without connection pooling, against a local stub of the upstream APIs.
+The stub (http.server from the standard library) answers every POST like the chip status endpoint does.
+Lookups are sent the way retrieve_api used to, with a bare requests.post opening a new connection each time,
+then through HttpClient (app/utils/clients.py), which keeps connections alive per upstream host.
+Lookups are also sent while the stub fails, to show the circuit breaker answering at once instead of waiting
+HttpClient is loaded from its file, so that the benchmark only needs requests
+
+Usage: python scripts/bench_http_client.py [--lookups 1000] [--delay 0.002]
+"""
+
+import os
+import json
+import time
+import argparse
+import statistics
+import threading
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, as App Engine does
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    failing = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        status = 503 if self.failing else 200
+        body = json.dumps({'chip_id': '1', 'status': 'active', 'description': 'Working'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def load_client():
+    spec = importlib.util.spec_from_file_location('clients', os.path.join(ROOT, 'app', 'utils', 'clients.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.HttpClient, module.UpstreamUnavailable
+
+
+def measure(lookup, lookups: int) -> list:
+    """Seconds taken by each lookup"""
+    latencies = []
+    for position in range(lookups):
+        started = time.perf_counter()
+        lookup(position)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(name: str, latencies: list):
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f'{name:<32} p50 {1000 * percentiles[49]:>8.2f} ms   p99 {1000 * percentiles[98]:>8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=1000, help='Lookups sent per measurement')
+    parser.add_argument('--delay', type=float, default=0.002, help='Seconds the stub takes to answer')
+    args = parser.parse_args()
+
+    HttpClient, UpstreamUnavailable = load_client()
+    StubHandler.delay = args.delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/chip_status'
+    headers = {'authorization': 'teste'}
+
+    try:
+        unpooled = measure(
+            lambda position: requests.post(url, data={'chip_id': position}, headers=headers), args.lookups,
+        )
+        client = HttpClient()
+        pooled = measure(lambda position: client.post(url, data={'chip_id': position}, headers=headers), args.lookups)
+        report('requests.post (no pooling)', unpooled)
+        report('HttpClient (pooled)', pooled)
+
+        # With the upstream down, the circuit opens after a few failures and lookups fail fast
+        StubHandler.failing = True
+        client = HttpClient(retries=0)
+
+        def failing_lookup(position):
+            try:
+                client.post(url, data={'chip_id': position}, headers=headers)
+            except UpstreamUnavailable:
+                pass
+
+        report('HttpClient (upstream down)', measure(failing_lookup, args.lookups))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
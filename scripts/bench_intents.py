@@ -0,0 +1,95 @@
+# scripts/bench_intents.py
+
+"""
+Micro-benchmark of intent matching as the number of intents grows from 6 to 1,000.
+IntentMatcher (app/utils/intents.py) is compared with the per-keyword re.search loop it replaced,
+whose cost grows with every keyword added, while the matcher's should stay flat.
+The matcher is loaded from its file, so that the benchmark needs neither Flask nor Redis nor a database
+
+Usage: python scripts/bench_intents.py [--messages 2000] [--sizes 6 10 100 1000]
+"""
+
+import os
+import re
+import time
+import random
+import argparse
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Keywords of the intents the bot shipped with, see SocketsController.INTENTS
+KEYWORDS = {
+    "receipt": ["account", "bank", "receipt"],
+    "chip_status": ["chip", "machine"],
+    "zip_code": ["zip", "address", "home"],
+    "sales": ["sale"],
+    "transactions": ["transaction"],
+    "tracking": ["track"],
+}
+
+MESSAGES = [
+    "Hi, I would like to track my order",
+    "My card machine is not working since yesterday",
+    "I have not received money in my bank account",
+    "Can you check this transaction for me please?",
+    "What is the status of my sale",
+    "I moved, how do I change my home address",
+    "Hello there, good morning",
+]
+
+
+def load_matcher():
+    spec = importlib.util.spec_from_file_location('intents', os.path.join(ROOT, 'app', 'utils', 'intents.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.IntentMatcher
+
+
+def generate_keywords(size: int) -> dict:
+    """The shipped intents, padded with synthetic ones of three keywords each up to size intents"""
+    keywords = dict(KEYWORDS)
+    for position in range(size - len(keywords)):
+        keywords[f'intent_{position}'] = [f'topic{position}', f'subject{position}', f'issue {position}']
+    return keywords
+
+
+def search_loop(keywords: dict, message: str):
+    """Matching as done before IntentMatcher: one re.search per keyword, the last hit winning"""
+    action = None
+    for intent, words in keywords.items():
+        for word in words:
+            if re.search(word, message):
+                action = intent
+    return action
+
+
+def measure(match, messages: list) -> float:
+    """Messages matched per second"""
+    started = time.perf_counter()
+    for message in messages:
+        match(message)
+    return len(messages) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help='Messages matched per measurement')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[6, 10, 100, 1000], help='Numbers of intents')
+    args = parser.parse_args()
+
+    IntentMatcher = load_matcher()
+    random.seed(0)
+    messages = [random.choice(MESSAGES) for _ in range(args.messages)]
+
+    print(f'{"intents":>8} {"matcher msg/s":>15} {"re.search msg/s":>17} {"speedup":>9}')
+    for size in args.sizes:
+        keywords = generate_keywords(size)
+        matcher = IntentMatcher(keywords)
+        compiled = measure(matcher.match, messages)
+        looped = measure(lambda message: search_loop(keywords, message), messages)
+        print(f'{size:>8} {compiled:>15,.0f} {looped:>17,.0f} {compiled / looped:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# scripts/bench_logging.py
+
+"""
+Per-call cost of system_logging over 100k calls, which should stay constant now that logging is configured once
+and records are only put on a queue, the listener thread writing them to the log file and the database.
+For comparison, the logging it replaced, which added a new RotatingFileHandler on every call, is timed too;
+there each call writes the record once per handler added so far, so the cost grows with every call.
+The messages go to app/logs/benchmark.log, removed afterwards, and to a throwaway SQLite database
+Run from the root of the repository, with the application's requirements installed
+
+Usage: python scripts/bench_logging.py [--calls 100000] [--window 10000] [--legacy-calls 500]
+"""
+
+import os
+import sys
+import glob
+import shutil
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOG_FILE = 'benchmark.log'
+
+
+def measure(log, calls: int, window: int) -> list:
+    """Average seconds per call over each window of calls"""
+    averages = []
+    started = time.perf_counter()
+    for position in range(1, calls + 1):
+        log(position)
+        if position % window == 0:
+            averages.append((time.perf_counter() - started) / window)
+            started = time.perf_counter()
+    return averages
+
+
+def report(name: str, averages: list, window: int):
+    print(name)
+    for position, average in enumerate(averages, 1):
+        print(f'  calls {(position - 1) * window + 1:>7}-{position * window:<7} {1e6 * average:>10.1f} us/call')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100000, help='Calls to system_logging')
+    parser.add_argument('--window', type=int, default=10000, help='Calls averaged together')
+    # Each handler keeps a file open, so this stays well below the limit of open files
+    parser.add_argument('--legacy-calls', type=int, default=500, help='Calls with a handler added per call')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "logging.db")}'
+    from app import create_app, db
+    from app.utils import system_logging, set_logger
+
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    folder = app.config.get('LOG_FOLDER', './logs') or './logs'
+    try:
+        with app.app_context():
+            db.create_all()
+
+            legacy = logging.getLogger('benchmark.legacy')
+            legacy.setLevel(logging.INFO)
+            legacy.propagate = False
+
+            def add_handler_per_call(position):
+                legacy.addHandler(set_logger(os.path.join(directory, LOG_FILE)))
+                legacy.info(f'Benchmark message {position}')
+
+            window = max(args.legacy_calls // 10, 1)
+            report('Handler added per call', measure(add_handler_per_call, args.legacy_calls, window), window)
+            for handler in list(legacy.handlers):
+                legacy.removeHandler(handler)
+                handler.close()
+
+            averages = measure(
+                lambda position: system_logging(f'Benchmark message {position}', exception=False, log_file=LOG_FILE),
+                args.calls, args.window,
+            )
+            report('system_logging', averages, args.window)
+
+            # The calls only queued the records: time the listener takes to write them all
+            started = time.perf_counter()
+            while app.log_listener.queue.qsize():
+                time.sleep(0.01)
+            print(f'Records written by the listener {time.perf_counter() - started:.2f}s after the last call')
+    finally:
+        for filename in glob.glob(os.path.join(folder, f'{LOG_FILE}*')):
+            os.remove(filename)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# scripts/bench_lookups.py
+
+"""
+Latency of the financial lookups made by SocketsController.request_database, with and without indexes.
+For every scale, synthetic sales, transactions and receipts are loaded into a fresh SQLite database,
+then random lookups are timed once with the tables' indexes dropped (as before they were added) and once with them
+Run from the root of the repository, with the application's requirements installed
+
+Usage: python scripts/bench_lookups.py [--scales 10000 100000 1000000] [--lookups 200]
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import datetime
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import SaleModel, TransactionModel, ReceiptModel  # noqa: E402
+from app.controllers import SocketsController  # noqa: E402
+
+MODELS = (SaleModel, TransactionModel, ReceiptModel)
+# Merchants share the rows, so that lookups by merchant return several rows as in production
+ROWS_PER_MERCHANT = 10
+
+
+def generate(model, size: int):
+    """Yield the synthetic rows of the model, with IDs and merchants numbered from 1"""
+    merchants = max(size // ROWS_PER_MERCHANT, 1)
+    for position in range(1, size + 1):
+        merchant_id = position % merchants + 1
+        # A different day for each row of a merchant, as receipts are unique per merchant and date
+        created_at = str(datetime.date(2020, 1, 1) + datetime.timedelta(days=position // merchants))
+        row = {'id': uuid.uuid4(), 'merchant_id': merchant_id, 'created_at': created_at}
+        if model is SaleModel:
+            row.update(id_sale=position, chip_id=f'CHIP{position}', status='delivered', description='Delivered')
+        elif model is TransactionModel:
+            row.update(transaction_id=position, value=position % 1000 + 0.5)
+        else:
+            row.update(status='paid', description='Transferred', value=position % 1000 + 0.5)
+        yield row
+
+
+def load(size: int, chunk: int = 10000):
+    for model in MODELS:
+        model.__table__.create(db.engine)
+        rows = []
+        for row in generate(model, size):
+            rows.append(row)
+            if len(rows) >= chunk:
+                db.session.execute(model.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+        db.session.commit()
+
+
+def indexes(create: bool):
+    for model in MODELS:
+        for index in model.__table__.indexes:
+            if create:
+                index.create(db.engine)
+            else:
+                index.drop(db.engine)
+
+
+def measure(intent, size: int, lookups: int) -> list:
+    """Seconds taken by each lookup of random identifiers, as the bot makes it"""
+    upper = size if intent.column != 'merchant_id' else max(size // ROWS_PER_MERCHANT, 1)
+    latencies = []
+    for _ in range(lookups):
+        identifier = str(random.randint(1, upper))
+        started = time.perf_counter()
+        SocketsController.request_database(intent, identifier)
+        latencies.append(time.perf_counter() - started)
+        db.session.rollback()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6], help='Rows per table')
+    parser.add_argument('--lookups', type=int, default=200, help='Lookups timed per intent')
+    args = parser.parse_args()
+
+    app = create_app()
+    random.seed(0)
+    # Lookups of a single table: by sale, by transaction, and the merchant's receipts, transactions and sales
+    intents = [SocketsController.INTENTS.get(name) for name in ('sales', 'transactions', 'receipt')]
+    intents += [lookup for lookup in SocketsController.INTENTS.get('payment').lookups if lookup.name != 'receipt']
+
+    print(f'{"rows":>9} {"lookup":<28} {"no index p50":>13} {"indexed p50":>12} {"speedup":>9}')
+    for size in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(directory, "lookups.db")}'
+            with app.app_context():
+                load(size)
+                indexes(create=False)
+                before = {intent: measure(intent, size, args.lookups) for intent in intents}
+                indexes(create=True)
+                after = {intent: measure(intent, size, args.lookups) for intent in intents}
+                for intent in intents:
+                    name = f'{intent.model.__tablename__}.{intent.column}'
+                    scan, seek = statistics.median(before[intent]), statistics.median(after[intent])
+                    print(f'{size:>9} {name:<28} {1000 * scan:>10.2f} ms {1000 * seek:>9.2f} ms {scan / seek:>8.1f}x')
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# scripts/bench_mail.py
+
+"""
+Emails sent per second by MailDispatcher against a local SMTP server (aiosmtpd), pooled and with a connection per email.
+Pooled, each sender thread sends up to MAIL_BATCH_SIZE emails over one connection. With --batch-size 1 for the
+second run, every email opens and closes its own connection, as the thread per email used to.
+Both runs use the same number of sender threads. --handshake-ms delays the server's reply to EHLO, standing in
+for the TLS handshake and login that a real mail server adds to every connection.
+Run from the root of the repository, with the application's requirements and aiosmtpd installed
+
+Usage: python scripts/bench_mail.py [--emails 1000] [--concurrency 2] [--batch-size 50] [--handshake-ms 0]
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_mail import Message  # noqa: E402
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from app import create_app, mail  # noqa: E402
+from app.communication.email import MailDispatcher  # noqa: E402
+
+
+class CountingHandler:
+    """Accepts every email, counting emails and connections"""
+
+    def __init__(self, handshake: float):
+        self.handshake = handshake
+        self.lock = threading.Lock()
+        self.emails = 0
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self.lock:
+            self.connections += 1
+        if self.handshake:
+            await asyncio.sleep(self.handshake)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.emails += 1
+        return '250 Message accepted for delivery'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run(app, handler, emails: int, concurrency: int, batch_size: int) -> tuple:
+    """Send the emails through a fresh dispatcher and wait for all of them to be sent"""
+    dispatcher = MailDispatcher(app, concurrency=concurrency, batch_size=batch_size, idle_timeout=1, max_size=emails)
+    connections = handler.connections
+    started = time.perf_counter()
+    for position in range(emails):
+        msg = Message(f'Benchmark {position}', sender='bench@example.com', recipients=['support@example.com'])
+        msg.body = 'Benchmark email'
+        dispatcher.add(msg)
+    while dispatcher.counters['sent'] + dispatcher.counters['failed'] < emails:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    return elapsed, dispatcher.counters['failed'], handler.connections - connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=1000, help='Emails sent per run')
+    parser.add_argument('--concurrency', type=int, default=2, help='Sender threads of the dispatcher')
+    parser.add_argument('--batch-size', type=int, default=50, help='Emails per connection of the pooled run')
+    parser.add_argument('--handshake-ms', type=float, default=0, help='Delay of the reply to EHLO, in milliseconds')
+    args = parser.parse_args()
+
+    handler = CountingHandler(args.handshake_ms / 1000)
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    try:
+        app = create_app()
+        app.config.update(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=controller.port, MAIL_USE_TLS=False,
+            MAIL_USE_SSL=False, MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_SUPPRESS_SEND=False,
+        )
+        # Flask-Mail reads its settings when initialised
+        mail.init_app(app)
+        print(f'{args.emails:,} emails, {args.concurrency} sender threads, {args.handshake_ms:g} ms handshake')
+        results = {}
+        for name, batch_size in (('pooled', args.batch_size), ('connection per email', 1)):
+            elapsed, failed, connections = run(app, handler, args.emails, args.concurrency, batch_size)
+            results[name] = args.emails / elapsed
+            print(f'  {name:<22} {results[name]:>10,.0f} emails/s   {connections:>6,} connections   {failed} failed')
+        print(f'Pooled sends {results["pooled"] / results["connection per email"]:.1f}x the emails per second')
+        if handler.emails < 2 * args.emails:
+            print(f'The server received {handler.emails:,} emails of {2 * args.emails:,}')
+            return 1
+    finally:
+        controller.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# scripts/bench_rooms.py
+
+"""
+Outbound Socket.IO frames per message with N clients connected, before and after emitting to conversation rooms.
+Before, every reply and pong was broadcast with socketIO.emit, so each message cost one frame per connected client.
+Now each client joins the room of its conversation on setup, and a reply goes only to that room through
+send_to_conversation, and a pong only to the client that sent the ping.
+N test clients connect, each in a conversation of its own, then a reply and a ping are sent both ways
+and the frames received by all the clients are counted.
+The Redis message queue, which relays emits between processes, is replaced by the in-process manager, which delivers
+the same frames within a single process. The database is a throwaway SQLite file.
+Run from the root of the repository, with the application's requirements installed
+
+Usage: python scripts/bench_rooms.py [--clients 10 100 1000]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+
+CHANNEL = 'received message'
+
+
+def frames(clients: list) -> int:
+    """Frames received by the clients since the last call"""
+    return sum(len(client.get_received()) for client in clients)
+
+
+def measure(app, socket_io, send_to_conversation, count: int) -> dict:
+    """Frames sent for one reply and one ping, with count clients connected"""
+    clients = [socket_io.test_client(app) for _ in range(count)]
+    try:
+        for position, client in enumerate(clients):
+            client.emit('setup', {'id': f'conversation-{position}'})
+        frames(clients)
+        # One of the conversations receives a reply, then pings
+        uid, payload = 'conversation-0', {'message': 'Your money is on its way', 'id': 'conversation-0'}
+        socket_io.emit(CHANNEL, payload)
+        broadcast = frames(clients)
+        send_to_conversation(CHANNEL, payload, uid)
+        room = frames(clients)
+        # The handler of my_ping used to broadcast the pong
+        socket_io.emit('my_pong')
+        broadcast_pong = frames(clients)
+        clients[0].emit('my_ping')
+        pong = frames(clients)
+    finally:
+        for client in clients:
+            client.disconnect()
+    return {'reply': (broadcast, room), 'pong': (broadcast_pong, pong)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000], help='Numbers of clients connected')
+    args = parser.parse_args()
+
+    app = create_app()
+    from app.views import socketIO, send_to_conversation
+
+    # Before any client connects, so that the manager of the message queue is never started
+    manager = socketio.BaseManager()
+    socketIO.server.manager = manager
+    manager.set_server(socketIO.server)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(directory, "rooms.db")}'
+        with app.app_context():
+            db.create_all()
+            print(f'{"clients":>8} {"event":>6} {"broadcast":>10} {"room":>6}')
+            for count in args.clients:
+                for event, (broadcast, room) in measure(app, socketIO, send_to_conversation, count).items():
+                    print(f'{count:>8,} {event:>6} {broadcast:>10,} {room:>6,}')
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
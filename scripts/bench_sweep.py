@@ -0,0 +1,100 @@
+# scripts/bench_sweep.py
+
+"""
+Time taken by the sweep of handle_unhandled_messages to find the conversations awaiting a reply, among 100k.
+The full scan it replaced loaded every conversation and the messages of each, one query per conversation,
+only to look at the last message; ConversationModel.awaiting_reply only reads the conversations whose latest
+message is from the client, through the partial index ix_conversations_awaiting_reply.
+Synthetic conversations are loaded into a throwaway SQLite database, with a share of them awaiting a reply
+Run from the root of the repository, with the application's requirements installed
+
+Usage: python scripts/bench_sweep.py [--conversations 100000] [--awaiting 0.01] [--messages 4]
+"""
+
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import ConversationModel, MessageModel  # noqa: E402
+
+
+def load(conversations: int, awaiting: float, messages: int, chunk: int = 10000):
+    """Load the conversations, every 1/awaiting-th one ending with a message from the client"""
+    every = max(int(round(1 / awaiting)), 1) if awaiting else 0
+    started = datetime.datetime(2022, 1, 1)
+    rows, bodies = [], []
+    for position in range(conversations):
+        uid = f'conversation-{position}'
+        sender = 'client' if every and position % every == 0 else 'system'
+        last = started + datetime.timedelta(seconds=position)
+        rows.append({'conversation_id': uid, 'last_message_sender': sender, 'last_message_at': last})
+        for number in range(messages):
+            # Messages alternate between the bot and the client, and end with the conversation's last sender
+            from_client = (messages - number) % 2 == (1 if sender == 'client' else 0)
+            bodies.append({
+                'conversation_id': uid, 'body': f'Message {number}', 'sender': 'client' if from_client else 'system',
+                'timestamp': last - datetime.timedelta(milliseconds=messages - number),
+            })
+        if len(rows) >= chunk:
+            db.session.execute(ConversationModel.__table__.insert(), rows)
+            db.session.execute(MessageModel.__table__.insert(), bodies)
+            rows, bodies = [], []
+    if rows:
+        db.session.execute(ConversationModel.__table__.insert(), rows)
+        db.session.execute(MessageModel.__table__.insert(), bodies)
+    db.session.commit()
+
+
+def full_scan() -> list:
+    """Conversations awaiting a reply, found as handle_unhandled_messages used to"""
+    found = []
+    for conversation in ConversationModel.query.all():
+        messages = ConversationModel.retrieve_conversations([conversation])[0]['messages']
+        if messages and messages[-1]['is_client']:
+            found.append(conversation.conversation_id)
+    return found
+
+
+def awaiting_reply() -> list:
+    return [conversation.conversation_id for conversation in ConversationModel.awaiting_reply()]
+
+
+def measure(find) -> tuple:
+    started = time.perf_counter()
+    found = find()
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+    return elapsed, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=100000, help='Conversations loaded')
+    parser.add_argument('--awaiting', type=float, default=0.01, help='Share of conversations awaiting a reply')
+    parser.add_argument('--messages', type=int, default=4, help='Messages per conversation')
+    args = parser.parse_args()
+
+    app = create_app()
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(directory, "sweep.db")}'
+        with app.app_context():
+            db.create_all()
+            load(args.conversations, args.awaiting, args.messages)
+            incremental, found = measure(awaiting_reply)
+            scan, scanned = measure(full_scan)
+            assert sorted(found) == sorted(scanned), 'the sweeps disagree on the conversations awaiting a reply'
+            print(f'{args.conversations:,} conversations, {len(found):,} awaiting a reply')
+            print(f'  full scan       {scan:>10.3f} s')
+            print(f'  awaiting_reply  {incremental:>10.3f} s   ({scan / incremental:,.0f}x faster)')
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# scripts/bench_turns.py
+
+"""
+Database commits per conversational turn, and turns per second, with and without MESSAGE_WRITE_BEHIND.
+Each turn runs SocketsController.answer: the client's message, the conversation's state and the replies are
+written in one transaction. With MESSAGE_WRITE_BEHIND, the messages of conversations whose state is committed are
+written by the write-behind buffer instead, which group commits them with the messages of the other conversations.
+--threads workers answer --conversations conversations at the same time, --turns turns each, after a first turn
+per conversation that commits its state. Commits are counted on the engine, so the buffer's commits are included,
+and a run ends once every message is in the database.
+Redis is replaced by fakeredis. The database is a throwaway SQLite file, or --database e.g. a PostgreSQL URL,
+whose tables are created if need be and whose benchmark rows are deleted afterwards.
+Run from the root of the repository, with the application's requirements and fakeredis installed
+
+Usage: python scripts/bench_turns.py [--conversations 100] [--turns 10] [--threads 8] [--database URL]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import ConversationModel, MessageModel  # noqa: E402
+from app.controllers import SocketsController  # noqa: E402
+
+PREFIX = 'bench-turns'
+
+
+class CommitCounter:
+    """Counts the transactions committed on the engine's connections, from any thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commits = 0
+
+    def __call__(self, connection):
+        with self.lock:
+            self.commits += 1
+
+
+def run(app, counter: CommitCounter, name: str, conversations: int, turns: int, threads: int) -> tuple:
+    """Answer the conversations' turns, return the commits and seconds taken once all messages are written"""
+    uids = [f'{PREFIX}-{name}-{position}' for position in range(conversations)]
+
+    def turn(uid, count):
+        with app.app_context():
+            for _ in range(count):
+                replies = SocketsController.answer('hello', uid)
+                assert not replies[0].startswith('Unable to continue'), f'turn of {uid} failed'
+
+    with ThreadPoolExecutor(threads) as pool:
+        # The first turn creates the conversation and commits its state, so that the others can be written behind
+        list(pool.map(turn, uids, [1] * conversations))
+        # Each turn writes the client's message and the reply
+        expected = MessageModel.query.filter(MessageModel.conversation_id.in_(uids)).count() + 2 * turns * conversations
+        db.session.rollback()
+        commits, started = counter.commits, time.perf_counter()
+        list(pool.map(turn, uids, [turns] * conversations))
+    while MessageModel.query.filter(MessageModel.conversation_id.in_(uids)).count() < expected:
+        db.session.rollback()
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+    return counter.commits - commits, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=100, help='Conversations answered at the same time')
+    parser.add_argument('--turns', type=int, default=10, help='Turns measured per conversation')
+    parser.add_argument('--threads', type=int, default=8, help='Turns run at the same time')
+    parser.add_argument('--database', help='Database URL, by default a throwaway SQLite file')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.redis = fakeredis.FakeRedis()
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database or f'sqlite:///{os.path.join(directory, "turns.db")}'
+        with app.app_context():
+            db.create_all()
+            counter = CommitCounter()
+            event.listen(db.engine, 'commit', counter)
+            turns = args.conversations * args.turns
+            print(f'{args.conversations:,} conversations, {args.turns} turns each, {args.threads} threads')
+            try:
+                for name, write_behind in (('inline', False), ('write-behind', True)):
+                    app.config['MESSAGE_WRITE_BEHIND'] = write_behind
+                    commits, elapsed = run(app, counter, name, args.conversations, args.turns, args.threads)
+                    print(f'  {name:<14} {commits / turns:>6.2f} commits per turn   {turns / elapsed:>10,.0f} turns/s')
+            finally:
+                event.remove(db.engine, 'commit', counter)
+                like = f'{PREFIX}-%'
+                MessageModel.query.filter(MessageModel.conversation_id.like(like)).delete(synchronize_session=False)
+                ConversationModel.query.filter(
+                    ConversationModel.conversation_id.like(like)).delete(synchronize_session=False)
+                db.session.commit()
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
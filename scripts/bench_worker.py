@@ -0,0 +1,83 @@
+# scripts/bench_worker.py
+
+"""
+Per-job overhead of the RQ workers, before and after the Flask app was set up once per worker process.
+Before, every job called TaskUtil.get_app, which ran create_app (settings, Redis, the queues, the scheduler, TOTP)
+and pushed a new app context. Now AppWorker sets the app up when it starts, and get_app returns it to every job.
+Both runs drain the same number of jobs that do nothing but get the app, as every task does, in burst mode.
+The before run uses SimpleWorker, which also runs the jobs in-process, so only the set-up of the app differs.
+Redis is replaced by fakeredis. The jobs do not touch the database.
+Run from the root of the repository, with the application's requirements and fakeredis installed
+
+Usage: python scripts/bench_worker.py [--jobs 1000]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis  # noqa: E402
+from rq import Queue  # noqa: E402
+from rq.worker import SimpleWorker  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.utils import AppWorker, TaskUtil  # noqa: E402
+
+# App contexts pushed by the jobs of the before run, which were never popped
+CONTEXTS = []
+
+
+def get_app_before():
+    """TaskUtil.get_app as it was: a fresh app and app context on every call"""
+    app = create_app()
+    context = app.app_context()
+    context.push()
+    CONTEXTS.append(context)
+    return app
+
+
+def job_before():
+    get_app_before()
+
+
+def job_after():
+    TaskUtil.get_app()
+
+
+def drain(worker_class, job, jobs: int, connection) -> float:
+    """Seconds a burst worker takes to run the jobs"""
+    queue = Queue('bench_worker', connection=connection)
+    for _ in range(jobs):
+        queue.enqueue(job)
+    worker = worker_class([queue], connection=connection)
+    started = time.perf_counter()
+    worker.work(burst=True)
+    elapsed = time.perf_counter() - started
+    finished = queue.finished_job_registry.count
+    connection.flushall()
+    assert finished == jobs, f'{finished} of {jobs} jobs finished'
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=1000, help='Jobs run by each worker')
+    args = parser.parse_args()
+
+    connection = fakeredis.FakeRedis()
+    before = drain(SimpleWorker, job_before, args.jobs, connection)
+    while CONTEXTS:
+        CONTEXTS.pop().pop()
+    after = drain(AppWorker, job_after, args.jobs, connection)
+
+    print(f'{args.jobs:,} jobs')
+    print(f'  create_app per job      {1000 * before / args.jobs:>8.3f} ms per job')
+    print(f'  AppWorker, app cached   {1000 * after / args.jobs:>8.3f} ms per job')
+    print(f'Removed per job: {1000 * (before - after) / args.jobs:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# scripts/check_chats.py
+
+"""
+Checks of the chats poller (ChatsController) against the local fake of the chats API, see fake_chats.py.
+Each scenario polls the fake and checks what was answered, sent and saved:
+messages are answered once, the bot's own messages are never answered, a poller skipping a locked conversation
+never moves its cursor back, a failed send is retried from the outbox without running the turn again,
+and a turn that was not committed is neither sent nor skipped.
+Redis is replaced by fakeredis (pip install "fakeredis[lua]", the locks use Lua scripts) and the database
+by a throwaway SQLite file. Run from the root of the repository. Exits with 1 if any scenario fails
+
+Usage: python scripts/check_chats.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chats import FakeChats  # noqa: E402
+
+
+def scenarios(app, fake):
+    """Yield the name of each scenario with a callable that raises if the scenario fails"""
+    from app.models import MessageModel
+    from app.controllers import ChatsController, SocketsController
+
+    def cursor(uid):
+        saved = app.redis.hget(ChatsController.cursors_key(), uid)
+        return json.loads(saved).get('message_id') if saved else None
+
+    def client_messages(uid):
+        return MessageModel.query.filter(MessageModel.conversation_id == uid, MessageModel.sender == 'client').count()
+
+    def answered_once():
+        uid = '1001'
+        fake.add_message(uid, 'hello')
+        ChatsController.poll()
+        assert len(fake.sent.get(uid, [])) == 1, f'{len(fake.sent.get(uid, []))} replies sent rather than 1'
+        ChatsController.poll()
+        assert len(fake.sent[uid]) == 1, 'the message was answered again'
+        assert client_messages(uid) == 1, f'{client_messages(uid)} turns run rather than 1'
+
+    def own_messages():
+        uid = '1002'
+        fake.add_message(uid, 'hello')
+        for _ in range(3):
+            ChatsController.poll()
+        # The reply lists the options, whose names are keywords: answering it would start another turn
+        assert len(fake.sent[uid]) == 1, f'the bot answered its own messages: {fake.sent[uid]}'
+        assert cursor(uid) == fake.conversations[uid][-1]['message_id'], 'cursor not moved past the bot\'s reply'
+
+    def lock_held():
+        uid = '1003'
+        first = fake.add_message(uid, 'hello')
+        lock = app.redis.lock(SocketsController.lock_key(uid), timeout=60)
+        assert lock.acquire(blocking=False)
+        handle = ChatsController.__dict__['handle_conversation']
+
+        def racing(cls, conversation_id):
+            # The poller holding the lock handles the message while this poller runs
+            if conversation_id == uid:
+                ChatsController.save_cursor(uid, first)
+            return handle.__func__(cls, conversation_id)
+
+        ChatsController.handle_conversation = classmethod(racing)
+        try:
+            ChatsController.poll()
+        finally:
+            ChatsController.handle_conversation = handle
+            lock.release()
+        assert cursor(uid) == first, f'cursor moved back to {cursor(uid)}'
+        ChatsController.poll()
+        assert not fake.sent.get(uid), 'a message handled by the lock holder was answered again'
+
+    def outbox_failure():
+        uid = '1004'
+        fake.add_message(uid, 'hello')
+        fake.failing_sends = True
+        try:
+            ChatsController.poll()
+        finally:
+            fake.failing_sends = False
+        assert not fake.sent.get(uid), 'a failed send was counted as sent'
+        assert app.redis.llen(ChatsController.outbox_key(uid)) == 1, 'the reply is not waiting in the outbox'
+        assert cursor(uid) == f'{uid}-0', 'the committed turn did not move the cursor'
+        ChatsController.poll()
+        ChatsController.poll()
+        assert len(fake.sent.get(uid, [])) == 1, f'{len(fake.sent.get(uid, []))} replies sent rather than 1'
+        assert not app.redis.llen(ChatsController.outbox_key(uid)), 'the outbox was not emptied'
+        assert client_messages(uid) == 1, 'the turn was run again rather than its reply resent'
+
+    def uncommitted_turn():
+        uid = '1005'
+        fake.add_message(uid, 'hello')
+        answer = SocketsController.__dict__['answer']
+        SocketsController.answer = classmethod(lambda cls, *args, **kwargs: ['Unable to continue. Please refresh page'])
+        try:
+            ChatsController.poll()
+        finally:
+            SocketsController.answer = answer
+        assert not fake.sent.get(uid), 'the failure was sent to the client'
+        assert cursor(uid) is None, 'the cursor moved past a message whose turn was not committed'
+        ChatsController.poll()
+        assert len(fake.sent.get(uid, [])) == 1, 'the message was not answered once the turn could be committed'
+
+    yield 'answered once', answered_once
+    yield 'own messages', own_messages
+    yield 'lock held', lock_held
+    yield 'outbox failure', outbox_failure
+    yield 'uncommitted turn', uncommitted_turn
+
+
+def main():
+    import fakeredis
+    from app import create_app, db
+
+    app = create_app()
+    fake = FakeChats().start()
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(directory, "chats.db")}'
+        app.config['CHATS_URL'] = fake.url
+        # Every active conversation is checked on every poll
+        app.config['CHATS_REFRESH_INTERVAL'] = 0
+        app.redis = fakeredis.FakeRedis()
+        try:
+            with app.app_context():
+                db.create_all()
+                for name, scenario in scenarios(app, fake):
+                    try:
+                        scenario()
+                        print(f'ok      {name}')
+                    except Exception:
+                        failed += 1
+                        print(f'FAILED  {name}\n{traceback.format_exc()}')
+                db.session.remove()
+                db.engine.dispose()
+        finally:
+            fake.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# scripts/check_logging.py
+
+"""
+Check of the logging pipeline under eventlet, monkey patched as run.py does for the web server.
+Green threads log through system_logging while a ticker green thread measures how long the hub stalls, then
+the records are checked to have reached both the log file and the database, through the write-behind log buffer.
+The check fails if any record is missing or the hub stalls for longer than --max-stall seconds.
+The database is a throwaway SQLite file, the log file app/logs/check_logging.log, removed afterwards.
+Run from the root of the repository, with the application's requirements installed. Exits with 1 on failure
+
+Usage: python scripts/check_logging.py [--records 2000] [--greenlets 20] [--max-stall 0.1]
+"""
+
+import eventlet
+
+eventlet.monkey_patch()
+
+import os  # noqa: E402
+import sys  # noqa: E402
+import glob  # noqa: E402
+import time  # noqa: E402
+import shutil  # noqa: E402
+import argparse  # noqa: E402
+import tempfile  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOG_FILE = 'check_logging.log'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=2000, help='Records logged in all')
+    parser.add_argument('--greenlets', type=int, default=20, help='Green threads logging at the same time')
+    parser.add_argument('--max-stall', type=float, default=0.1, help='Longest acceptable stall of the hub, in seconds')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "logging.db")}'
+    from app import create_app, db
+    from app.models import LogModel
+    from app.utils import system_logging
+
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    folder = app.config.get('LOG_FOLDER', './logs') or './logs'
+    stalls, running = [], [True]
+
+    def ticker():
+        last = time.monotonic()
+        while running[0]:
+            eventlet.sleep(0.005)
+            now = time.monotonic()
+            stalls.append(now - last - 0.005)
+            last = now
+
+    def log(offset):
+        for position in range(offset, args.records, args.greenlets):
+            system_logging(f'Check message {position}', exception=False, log_file=LOG_FILE)
+            eventlet.sleep(0)
+
+    try:
+        with app.app_context():
+            db.create_all()
+            tick = eventlet.spawn(ticker)
+            pool = eventlet.GreenPool(args.greenlets)
+            for offset in range(args.greenlets):
+                pool.spawn(log, offset)
+            pool.waitall()
+
+            # Wait for the listener to write the records, and the log buffer to flush them
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                in_file = sum(
+                    1 for filename in glob.glob(os.path.join(folder, f'{LOG_FILE}*'))
+                    for line in open(filename) if 'Check message' in line
+                )
+                in_database = LogModel.query.filter(LogModel.message.like('Check message%')).count()
+                db.session.rollback()
+                if in_file >= args.records and in_database >= args.records:
+                    break
+                eventlet.sleep(0.1)
+            running[0] = False
+            tick.wait()
+    finally:
+        for filename in glob.glob(os.path.join(folder, f'{LOG_FILE}*')):
+            os.remove(filename)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    stall = max(stalls or [0.0])
+    print(f'{in_file} of {args.records} records in the log file, {in_database} in the database')
+    print(f'Longest stall of the hub while logging: {1000 * stall:.1f} ms')
+    return 0 if in_file >= args.records and in_database >= args.records and stall <= args.max_stall else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# scripts/fake_chats.py
+
+"""
+Local fake of the chats API: /conversations, /conversation_info and /send_message, as described in instructions.md.
+Conversations are held in memory. Messages sent through /send_message are listed among the conversation's messages,
+as the real API does, and sends can be made to fail, to exercise ChatsController against every outcome.
+Run it on its own and point CHATS_URL at it, or start it from a script with FakeChats().start()
+
+Usage: python scripts/fake_chats.py [--port 8081] [--conversations 1000]
+"""
+
+import json
+import time
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeChats:
+    """State of the fake API, and the server that serves it"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.lock = threading.Lock()
+        # Conversation ID -> list of messages, as returned by /conversation_info
+        self.conversations = {}
+        # Texts sent through /send_message, per conversation, in order
+        self.sent = {}
+        # Whether /send_message answers "sent": "false"
+        self.failing_sends = False
+        self.calls = {'conversations': 0, 'conversation_info': 0, 'send_message': 0}
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-chats', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_message(self, uid: str, text: str) -> str:
+        """Add a message to the conversation, as if the client wrote it, and return its ID"""
+        with self.lock:
+            messages = self.conversations.setdefault(str(uid), [])
+            message_id = f'{uid}-{len(messages)}'
+            # Created in order, even within the same second
+            created_at = str(int(time.time()) + len(messages))
+            messages.append({'message_id': message_id, 'text': text, 'created_at': created_at})
+            return message_id
+
+    def respond(self, endpoint: str, body: dict):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if endpoint == 'conversations':
+            return {'conversation_ids': [int(uid) if uid.isnumeric() else uid for uid in self.conversations]}
+        uid = str(body.get('conversation_id') or '')
+        if uid not in self.conversations:
+            return None
+        if endpoint == 'conversation_info':
+            with self.lock:
+                messages = [dict(message) for message in self.conversations[uid]]
+            return {'conversation_id': uid, 'messages': messages, 'merchant_id': '558392', 'subject': 'fake'}
+        if endpoint == 'send_message':
+            message = body.get('message') or ''
+            if self.failing_sends:
+                return {'conversation_id': uid, 'message': message, 'sent': 'false', 'decription': 'Failed'}
+            # The bot's replies are listed among the conversation's messages, like the client's
+            self.add_message(uid, message)
+            with self.lock:
+                self.sent.setdefault(uid, []).append(message)
+            return {'conversation_id': uid, 'message': message, 'sent': 'true', 'decription': 'OK'}
+        return None
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+                if self.headers.get('authorization') != 'teste':
+                    return self.reply(401, {'description': 'Unauthorized'})
+                # The API accepts form and JSON bodies alike
+                if raw.startswith('{'):
+                    body = json.loads(raw)
+                else:
+                    body = {key: values[-1] for key, values in parse_qs(raw).items()}
+                result = fake.respond(self.path.strip('/'), body)
+                self.reply(404 if result is None else 200, result or {'description': 'Not found'})
+
+            def reply(self, status: int, result: dict):
+                payload = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081, help='Port to listen on')
+    parser.add_argument('--conversations', type=int, default=1000, help='Active conversations, with a message each')
+    args = parser.parse_args()
+
+    fake = FakeChats(port=args.port)
+    for position in range(args.conversations):
+        fake.add_message(str(754893 + position), "hello, my money hasn't landed in my bank account yet")
+    print(f'Fake chats API at {fake.url}, with {args.conversations} active conversations')
+    fake.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
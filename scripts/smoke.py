@@ -0,0 +1,84 @@
+# scripts/smoke.py
+
+"""
+Smoke check: import the application and call its key functions once, against a throwaway SQLite database.
+Nothing here needs Redis, a mail server or the upstream APIs, so it can run anywhere the requirements are installed
+Run from the root of the repository. Exits with 1 if any check fails
+
+Usage: python scripts/smoke.py
+"""
+
+import os
+import sys
+import tempfile
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def checks(app):
+    """Yield the name of each check with a callable that raises if the check fails"""
+    from app import db
+    from app.models import Serializer, ConversationModel, MessageModel, time_now, format_timestamp
+    from app.controllers import SocketsController
+    from app.utils import IntentMatcher
+    from settings import get_settings
+
+    def settings():
+        assert get_settings() is get_settings(), 'settings are loaded again on every call'
+
+    def intents():
+        for message, intent in [('Please track my order', 'tracking'), ('My card machine is off', 'chip_status'),
+                                ('I was not paid the money', 'payment'), ('Good morning', None)]:
+            found = SocketsController.INTENTS.match(message)
+            assert (found.name if found else None) == intent, f'{message!r} matched {found} rather than {intent}'
+        assert IntentMatcher({'refund': ['refund', 'money back']}).match('I want my money back') == 'refund'
+
+    def serializer():
+        value = {'message': 'Hello', 'position': 1}
+        assert Serializer.loads(Serializer.dumps(value)) == value
+        assert format_timestamp(time_now())
+
+    def database():
+        db.create_all()
+        uid = 'smoke-test'
+        assert SocketsController.retrieve_conversation(uid), 'conversation not created'
+        assert SocketsController.save_message('Where is my sale?', uid) is None, 'message not saved'
+        assert MessageModel.query.filter(MessageModel.conversation_id == uid).count() == 2
+        assert [conversation.conversation_id for conversation in ConversationModel.awaiting_reply()] == [uid]
+        assert not ConversationModel.awaiting_reply(older_than=60), 'new message not left to the mailbox'
+        assert SocketsController.request_database(SocketsController.INTENTS.get('sales'), '1') is None
+
+    def routes():
+        assert len(list(app.url_map.iter_rules())) > 1, 'no routes registered'
+
+    yield 'settings', settings
+    yield 'intents', intents
+    yield 'serializer', serializer
+    yield 'database', database
+    yield 'routes', routes
+
+
+def main():
+    from app import create_app
+
+    app = create_app()
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(directory, "smoke.db")}'
+        with app.app_context():
+            for name, check in checks(app):
+                try:
+                    check()
+                    print(f'ok      {name}')
+                except Exception:
+                    failed += 1
+                    print(f'FAILED  {name}\n{traceback.format_exc()}')
+            from app import db
+            db.session.remove()
+            db.engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# settings.py
+
+"""
+This file loads the settings kept in .flaskenv and .env, once per process.
+The files are parsed when the settings are first needed and the result kept in an immutable Settings object,
+so that nothing on the hot paths (requests, jobs) reads them from disk again.
+Call reload_settings() to pick up changes to the files
+"""
+
+import os
+import threading
+from typing import NamedTuple
+
+# Environments that have a configuration in config.py
+ENVIRONMENTS = ('development', 'production', 'testing')
+
+
+class Settings(NamedTuple):
+    """Settings of the process, validated when loaded"""
+    # Environment from FLASK_ENV i.e. development, production or testing
+    flask_env: str
+    # Link to the Redis server used for the message queue, background tasks and caches
+    redis_url: str
+    # Host and port of the development server
+    run_host: str
+    run_port: int
+
+    @property
+    def is_development(self) -> bool:
+        return self.flask_env == 'development'
+
+
+SETTINGS = None
+LOCK = threading.Lock()
+
+
+def load_settings() -> Settings:
+    """
+    Read the settings from .flaskenv and .env.
+    The variables in .env are also exported to the environment, without overriding those already set,
+    so that config.py sees them
+    """
+    from dotenv import dotenv_values, load_dotenv
+
+    flask_config = dotenv_values('.flaskenv')
+    load_dotenv('.env')
+
+    # A FLASK_ENV missing from .flaskenv means production, while an unknown one falls back to development
+    flask_env = flask_config.get('FLASK_ENV') or 'production'
+    if flask_env not in ENVIRONMENTS:
+        flask_env = 'development'
+
+    redis_password = os.environ.get('REDIS_PASSWORD')
+    if flask_env != 'development' and redis_password:
+        redis_host = os.environ.get('REDIS_HOST') or 'localhost'
+        redis_port = os.environ.get('REDIS_PORT') or '6379'
+        redis_url = f'redis://:{redis_password}@{redis_host}:{int(redis_port) if redis_port.isnumeric() else 6379}'
+    else:
+        redis_url = os.environ.get('REDIS_URL') or 'redis://'
+
+    port = flask_config.get('FLASK_RUN_PORT')
+    return Settings(
+        flask_env=flask_env,
+        redis_url=redis_url,
+        run_host=flask_config.get('FLASK_RUN_HOST') or 'localhost',
+        run_port=int(port if port and port.isnumeric() else 5000),
+    )
+
+
+def get_settings() -> Settings:
+    """Return the settings of the process, loading them the first time"""
+    global SETTINGS
+    if SETTINGS is None:
+        with LOCK:
+            if SETTINGS is None:
+                SETTINGS = load_settings()
+    return SETTINGS
+
+
+def reload_settings() -> Settings:
+    """Read .flaskenv and .env again e.g. after editing them, and return the new settings"""
+    global SETTINGS
+    settings = load_settings()
+    with LOCK:
+        SETTINGS = settings
+    return settings